@@ -0,0 +1,270 @@
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import simdevices
+
+
+def summarize(wall, cpu):
+    """Throughput and jitter of per-iteration wall and CPU times."""
+    total = sum(wall)
+    ordered = sorted(wall)
+    return {
+        "count": len(wall),
+        "rate": len(wall) / total if total else float("inf"),
+        "mean": statistics.fmean(wall),
+        "jitter": statistics.pstdev(wall),
+        "p99": ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))],
+        "max": ordered[-1],
+        "cpu": statistics.fmean(cpu),
+    }
+
+
+def time_calls(func, n):
+    """Calls func() n times, returns the summary of the call times."""
+    wall, cpu = [], []
+    for _ in range(n):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        func()
+        wall.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - start_cpu)
+    return summarize(wall, cpu)
+
+
+def format_row(script, name, stats):
+    return (
+        f"{script:8} {name:26} {stats['rate']:10.1f}/s "
+        f"mean {stats['mean'] * 1e3:8.3f} ms "
+        f"jitter {stats['jitter'] * 1e3:8.3f} ms "
+        f"p99 {stats['p99'] * 1e3:8.3f} ms "
+        f"cpu {stats['cpu'] * 1e3:8.3f} ms"
+    )
+
+
+def bench_blower(args):
+    import blower_box_final
+    import u3
+
+    d = simdevices.FakeU3(latency=args.latency, noise=args.noise)
+    with contextlib.redirect_stdout(io.StringIO()):
+        os.makedirs("Blower_Data", exist_ok=True)
+        csv = blower_box_final.CSVFile()
+        csv.setFilename()
+        pid_obj = blower_box_final.PIDObject()
+        tdac = blower_box_final.ljtickdac.LJTickDAC(d, 6)
+        feedback = blower_box_final.u3feedback.FeedbackBatcher(d)
+        feedback.add("timer", u3.Timer(0))
+        feedback.add("counter", u3.Counter(1))
+        feedback.add_ain("digi", 1)
+
+        rows = {
+            "digihelic read": time_calls(
+                lambda: pid_obj.updateDigiVoltage(feedback), args.n
+            ),
+            "pid step": time_calls(
+                lambda: blower_box_final.runPID(pid_obj, tdac, d), args.n
+            ),
+            "feedback read + log": time_calls(
+                lambda: (
+                    pid_obj.updateDigiVoltage(feedback),
+                    blower_box_final.update_time_difference(csv, pid_obj),
+                ),
+                args.n,
+            ),
+            "log row": time_calls(
+                lambda: csv.writeToCSV(2.5, 1500.0, 400.0, 0, 0, 0), args.n
+            ),
+        }
+        csv.writer.close()
+
+        # The real scheduled loop, for timing jitter
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            thread = threading.Thread(
+                target=blower_box_final.main, kwargs={"device": d}
+            )
+            thread.start()
+            time.sleep(args.duration)
+            blower_box_final.stop_schedules()
+            thread.join()
+    report = [
+        line for line in output.getvalue().splitlines() if "cs:" not in line
+    ]
+    return rows, report
+
+
+def bench_ion(args):
+    import ion_precipitator
+
+    ion = ion_precipitator.IonPrecipitator(
+        simdevices.FakeU3(latency=args.latency, noise=args.noise)
+    )
+    volts = iter(range(10**9))
+    rows = {
+        "monitor read": time_calls(lambda: ion.d.getAIN(0), args.n),
+        "dac write": time_calls(
+            lambda: ion.tdac.update(next(volts) % 2 * 2.0, 0.0), args.n
+        ),
+        "log row": time_calls(
+            lambda: ion.csv_writer.writerow(
+                [time.strftime("%H:%M:%S"), "ON", 1000.0, 999.0]
+            ),
+            args.n,
+        ),
+    }
+    ion.close()
+    return rows, []
+
+
+def bench_mfc(args):
+    import mfc_control
+
+    controller = mfc_control.MFCController(
+        mfc_control.load_config(args.mfc_config)
+    )
+    controller.ljm.eWriteNames(
+        controller.handle,
+        controller.num_mfc,
+        controller.set_names,
+        controller.set_values,
+    )
+    rows = {
+        "flow read": time_calls(
+            lambda: controller.ljm.eReadNames(
+                controller.handle, controller.num_mfc, controller.read_names
+            ),
+            args.n,
+        ),
+        "log row": time_calls(
+            lambda: controller.data_writer.writerow(
+                [time.ctime()] + [1.0] * 2 * controller.num_mfc
+            ),
+            args.n,
+        ),
+    }
+    controller.stop()
+    return rows, []
+
+
+def bench_wind(args):
+    import capturewind_graph
+
+    anemometer = simdevices.FakeAnemometer(
+        rate=args.wind_rate, noise=args.noise * 100
+    ).start()
+    logger = capturewind_graph.WindDataLogger(port=anemometer.port)
+    try:
+        rows = {
+            "frame read + log": time_calls(logger.read_sample, args.n),
+            "log row": time_calls(
+                lambda: logger.log_data("Q 003.21 180 00"), args.n
+            ),
+        }
+    finally:
+        logger.close_app()
+        anemometer.close()
+    return rows, []
+
+
+def bench_camera(args):
+    import cv2
+    import captureimg
+
+    cap = captureimg.open_camera()
+    cap.latency = 0
+    n = max(1, args.n // 20)
+    frame = cap.read()[1]
+    rows = {
+        "frame read": time_calls(cap.read, n),
+        "timestamp overlay": time_calls(
+            lambda: captureimg.add_timestamp(frame), n
+        ),
+        "jpeg write": time_calls(lambda: cv2.imwrite("frame.jpg", frame), n),
+    }
+    cap.release()
+    return rows, []
+
+
+BENCHMARKS = {
+    "blower": bench_blower,
+    "ion": bench_ion,
+    "mfc": bench_mfc,
+    "wind": bench_wind,
+    "camera": bench_camera,
+}
+
+
+def run(args):
+    simdevices.install_u3(latency=args.latency, noise=args.noise)
+    simdevices.install_ljm(latency=args.latency, noise=args.noise)
+    simdevices.install_camera()
+    mfc_config = os.path.abspath(args.mfc_config)
+
+    for script in args.scripts or BENCHMARKS:
+        # Log files go to a scratch directory
+        with tempfile.TemporaryDirectory() as folder:
+            cwd = os.getcwd()
+            os.chdir(folder)
+            args.mfc_config = mfc_config
+            try:
+                rows, report = BENCHMARKS[script](args)
+            except ImportError as e:
+                print(f"{script:8} skipped: {e}")
+                continue
+            finally:
+                os.chdir(cwd)
+        for name, stats in rows.items():
+            print(format_row(script, name, stats))
+        for line in report:
+            print(f"{script:8} {line}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the acquisition and logging loops on "
+        "simulated devices"
+    )
+    parser.add_argument(
+        "scripts",
+        nargs="*",
+        metavar="script",
+        help=f"Any of {', '.join(BENCHMARKS)} (all by default)",
+    )
+    parser.add_argument("-n", type=int, default=500, help="Calls per row")
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5.0,
+        help="Seconds to run the scheduled blower loop",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0008,
+        help="Simulated seconds per device transaction",
+    )
+    parser.add_argument(
+        "--noise", type=float, default=0.002, help="Analog noise (V)"
+    )
+    parser.add_argument(
+        "--wind-rate",
+        type=float,
+        default=200.0,
+        help="Simulated anemometer frames per second",
+    )
+    parser.add_argument("--mfc-config", default="mfc_config.yml")
+    return parser
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    args = parser.parse_args()
+    for script in args.scripts:
+        if script not in BENCHMARKS:
+            parser.error(f"unknown script {script!r}")
+    run(args)
@@ -1,16 +1,32 @@
 import math
-import schedule
+import scheduler
 import u3
-import time
 import ljtickdac
 import os
-import csv
+import threading
+import functools
 import datetime as dt
+import datalogger
+import ringbuffer
+import blower_flow
+import u3stream
+import u3feedback
 from simple_pid import PID
 
 PID_TIME = 1   # how often pid runs (secs)
 DIGI_TIME = 0.25 # how often read from digihelic
 WRITE_TIME = 1 # write to csv file
+FLUSH_ROWS = 60 # rows buffered before writing to disk
+FLUSH_TIME = 10 # max secs rows stay buffered
+LOG_BACKEND = 'csv' # 'csv' or 'columnar' (binary, see datalogger.py)
+ROLLUPS = (60, 3600) # secs per row of the averaged files next to the raw one
+DIGI_FILTER = 'boxcar' # 'boxcar', 'ema' or 'median' pressure averaging
+MEDIAN_N = 5 # samples in median filter (spike rejection)
+NEGATIVE_DP = 'clip' # flow when digihelic reads below zero, see blower_flow.py
+ACQUISITION = 'poll' # 'poll' (AIN read every DIGI_TIME) or 'stream' (U3 hardware stream)
+STREAM_RATE = 1000 # digihelic scans per sec in stream mode
+STREAM_LOG = False # save every stream sample to Blower_Data (columnar)
+DEBUG = False # print each digihelic reading
 
 use_pid = False
 stop_running = False
@@ -19,50 +35,82 @@ class CSVFile:
     def __init__(self):
         self.previous_measurement = None
         self.previous_count = None
+        self.last_snapshot = None
         self.filename = ''
+        self.writer = datalogger.open_writer(
+            'Blower_Data/blower_data_%m-%d-%Y.csv',
+            ['Voltage Sent', 'RPM', 'Flow Rate', 'Current Time'],
+            backend=LOG_BACKEND,
+            skip=['Current Time'],
+            flush_rows=FLUSH_ROWS,
+            flush_interval=FLUSH_TIME,
+            rollups=ROLLUPS,
+        )
         self.rpm = 0
+        self.last_voltage = 'n/a'  #no voltages have been sent to blower yet
     
-    #csv file
+    #csv file, the writer starts a new one each day
     def setFilename(self):
-        current_date = dt.datetime.today().strftime("%m-%d-%Y")
-        self.filename = f'Blower_Data/blower_data_{current_date}.csv'
+        self.filename = self.writer.filename_for(dt.datetime.today())
+        self.recoverPrevVoltage()
 
     def set_count_and_measure(self, measure, count):
         self.previous_measurement = measure
         self.previous_count = count
 
+    #read the last line of a file by seeking backwards from the end
+    def readLastLine(self, filename, block_size=1024):
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'rb') as csv_file:
+            pos = csv_file.seek(0, os.SEEK_END)
+            data = b''
+            while pos > 0:
+                step = min(block_size, pos)
+                pos -= step
+                csv_file.seek(pos)
+                data = csv_file.read(step) + data
+                lines = data.rstrip(b'\r\n').split(b'\n')
+                if len(lines) > 1 or pos == 0:
+                    last_line = lines[-1].decode().strip()
+                    return last_line if last_line else None
+        return None
+
+    #recover voltage from last line of today's file, or yesterday's if empty
+    def recoverPrevVoltage(self):
+        yesterday = dt.datetime.today() - dt.timedelta(days=1)
+        prev_filename = self.writer.filename_for(yesterday)
+        for filename in (self.filename, prev_filename):
+            if LOG_BACKEND == 'columnar':
+                volts = datalogger.last_value(filename, 'Voltage Sent')
+                if volts is not None and not math.isnan(volts):
+                    self.last_voltage = volts
+                    return self.last_voltage
+                continue
+            last_line = self.readLastLine(filename)
+            if last_line is None:
+                continue
+            volts = last_line.split(',')[0]
+            if volts != 'Voltage Sent':  #only the header has been written
+                self.last_voltage = volts
+                return self.last_voltage
+        return self.last_voltage
+
     #get voltage from prev line
     def getPrevVoltage(self):
-        count_rows = 0
-        with open(self.filename, 'r') as csv_file:
-            csv_reader = csv.reader(csv_file)
-            for row in csv_reader:
-                count_rows +=1
-            
-        if (count_rows > 1): 
-            with open(self.filename) as csv_file:
-                last_line = csv_file.readlines()[-1] 
-            return(last_line.split(',')[0])
-        else:
-            return 'n/a'  #no voltages have been sent to blower yet
+        return self.last_voltage
 
     def writeToCSV(self, volts, rpm, flow, avgVolts, avgFlow, gains):
-        filename = self.filename 
         # rpm = time_label.cget("text")[12:]
-        time = dt.datetime.now().strftime("%H:%M:%S")
+        now = dt.datetime.now()
+        time = now.strftime("%H:%M:%S")
 
-        with open(filename, 'a', newline='') as csv_file:
-            csv_writer = csv.writer(csv_file)
-            checkSize = os.path.getsize(filename)
-           
-            if (checkSize == 0):  # writing header
-                csv_writer.writerow(['Voltage Sent', 'RPM', 'Flow Rate', 'Current Time'])
-            
-            if (volts != None): #not sure this condition is needed anymore
-                csv_writer.writerow([volts, rpm, flow, time]) 
-            else:
-                preVolts = self.getPrevVoltage()
-                csv_writer.writerow([preVolts, rpm, flow, time])
+        if (volts != None): #not sure this condition is needed anymore
+            self.last_voltage = volts
+            self.writer.writerow([volts, rpm, flow, time], now)
+        else:
+            preVolts = self.getPrevVoltage()
+            self.writer.writerow([preVolts, rpm, flow, time], now)
 
 class PIDObject:
     def __init__(self):
@@ -70,13 +118,24 @@ class PIDObject:
         kP, kI, kD = (0.0034, 0.0001722, 0.0003) 
         self.setpoint = 400 #lpm
         self.flow_rate = 0
+        self.flow_converter = blower_flow.FlowConverter(negative=NEGATIVE_DP)
         self.pid = PID(kP, kI, kD, self.setpoint, output_limits=(0,5), starting_output=3.75)
 
         # for reseting
         # kP, kI, kD = (0.0,0.00,0)
         # self.pid = PID(kP, kI, kD, self.setpoint, output_limits=(0,5), starting_output=0)
 
-        self.digi_voltage = []
+        # pressure window covers one pid period
+        if ACQUISITION == 'stream':
+            window = max(1, round(PID_TIME * STREAM_RATE))
+        else:
+            window = max(1, round(PID_TIME / DIGI_TIME))
+        self.digi_voltage = ringbuffer.SignalFilter(
+            window, mode=DIGI_FILTER, median_n=MEDIAN_N
+        )
+        self.digi_lock = threading.Lock() # stream thread adds samples
+        self.current_volts = None
+        self.snapshot = None # newest timer/counter/digi read in poll mode
         self.data = {
         'time': [],
         'Flow Rate (avg)': [],
@@ -86,44 +145,36 @@ class PIDObject:
         self.volts_sent = 0
         self.average_volts = 0
 
-    def updateDigiVoltage(self, d):
-        global DIGI_TIME
-        global PID_TIME
-        
-        cs_voltage = d.getAIN(1)
-        print("cs: ", cs_voltage)
-        self.digi_voltage.append(cs_voltage)
-
-        maxLength = (PID_TIME / DIGI_TIME) 
-        if (maxLength < 1): #if pid less than digi
-            maxLength = 1
-        if len(self.digi_voltage) > maxLength: 
-            self.digi_voltage.pop(0)
-
+    #reads timer, counter and digihelic in one packet, the write task logs
+    #the newest snapshot instead of reading the device again
+    def updateDigiVoltage(self, feedback):
+        self.snapshot = feedback.read()
+        cs_voltage = self.snapshot['digi']
+        if DEBUG:
+            print("cs: ", cs_voltage)
+        with self.digi_lock:
+            self.digi_voltage.append(cs_voltage)
+            self.current_volts = cs_voltage
+
+    #callback for blocks from the U3 stream
+    def addDigiVoltages(self, channel, samples, timestamp):
+        if not samples:
+            return
+        with self.digi_lock:
+            self.digi_voltage.extend(samples)
+            self.current_volts = samples[-1]
+
+    #returns False while there is no sample to average yet
     def averageDigiVoltage(self):
-        sum = 0
-        length = len(self.digi_voltage)
-        for i in range(length):
-            sum += self.digi_voltage[i]
-        self.average_volts = (sum/length)
+        with self.digi_lock:
+            if len(self.digi_voltage) > 0:
+                self.average_volts = self.digi_voltage.value
+                return True
+            return False
 
     def calcFlowRate(self, volts, updateSelf=True):
-        #convert volts to pressure
-        mA = 8.475 * volts  # according to labjack website
-        p_wc = (mA/64) - (1/16) # in wc
-        p_atm = 101325 # Pa
-        p_Pa = (p_wc * 248.84) + p_atm # convert to pascals and absolute
-        
-        # convert pressure to flow rate, using bernoulli
-        density = 1.225 # kg/m^3
-        deltaP = p_Pa - p_atm
-
-        velocity = math.sqrt(2*(deltaP)/density) #might be negative, need to check
-        
-        d = 2 * 0.0254 # units: m
-        area = math.pi/4*(d*d)
-        flow_rate = area * velocity #m^3/s
-        flow_rate_lpm = flow_rate * 60000 
+        #convert volts to pressure, then to flow rate using bernoulli
+        flow_rate_lpm = self.flow_converter(volts)
 
         if (updateSelf):    #change flow rate
             self.flow_rate = flow_rate_lpm
@@ -144,7 +195,10 @@ class PIDObject:
         #print('D: ', data)
 
 def runPID(pid_obj, tdac, d):
-    pid_obj.averageDigiVoltage()
+    #no digihelic sample yet (before the first stream block), 0 V would
+    #read as 0 lpm and drive the blower at full voltage
+    if not pid_obj.averageDigiVoltage():
+        return
     avg_cs_voltage = pid_obj.average_volts
     pid_obj.calcFlowRate(avg_cs_voltage)
     flow_rate = pid_obj.flow_rate
@@ -155,15 +209,25 @@ def runPID(pid_obj, tdac, d):
     tdac.update(float(volts_to_blower), 0.0)
     pid_obj.volts_sent = volts_to_blower
 
-def update_time_difference(csv, pid_obj, d, timer, counter):
-    startMeasures = d.getFeedback(timer, counter)
-    current_measurement = startMeasures[0]
-    current_count = startMeasures[1]
+#feedback: read here in stream mode, None to use the snapshot of the
+#newest digi read in poll mode
+def update_time_difference(csv, pid_obj, feedback=None):
+    #timer, counter and digihelic read in one getFeedback packet
+    snapshot = feedback.read() if feedback is not None else pid_obj.snapshot
+    if snapshot is None or snapshot is csv.last_snapshot:
+        return # no digi read since the last row
+    csv.last_snapshot = snapshot
+    current_measurement = snapshot['timer']
+    current_count = snapshot['counter']
 
     volts = pid_obj.volts_sent 
     #flow_rate = pid_obj.flow_rate #change
-    currVolts = d.getAIN(1)
-    flow_rate = pid_obj.calcFlowRate(currVolts, False)
+    #can't read AIN while streaming, use newest streamed sample instead
+    currVolts = snapshot.get('digi', pid_obj.current_volts)
+    if currVolts is not None:
+        flow_rate = pid_obj.calcFlowRate(currVolts, False)
+    else:
+        flow_rate = float('nan') #logged as nan, not an empty field
     avgVolts = pid_obj.average_volts
     if (avgVolts != 0):    
         avgFlow_Rate = pid_obj.calcFlowRate(avgVolts, False)
@@ -180,6 +244,14 @@ def update_time_difference(csv, pid_obj, d, timer, counter):
 
     csv.set_count_and_measure(current_measurement, current_count)
 
+# save each stream sample, spread back in time from when the block arrived
+def logStream(writer, channel, samples, timestamp):
+    block_end = dt.datetime.fromtimestamp(timestamp)
+    n = len(samples)
+    for i, volts in enumerate(samples):
+        sample_time = block_end - dt.timedelta(seconds=(n - 1 - i) / STREAM_RATE)
+        writer.writerow([volts], sample_time)
+
 # run blower without pid controller, using pid setpoint
 def runBlower(tdac, pid_obj):  
     volts = (0.0131 * pid_obj.setpoint) + 0.7221
@@ -191,13 +263,14 @@ def runBlower(tdac, pid_obj):
     pid_obj.volts_sent = volts
 
 
-def main():
+#device: an opened U3 (or a devicebroker.U3Proxy), one is opened if None
+def main(device=None):
     global WRITE_TIME
     global PID_TIME
     global DIGI_TIME
     global use_pid
     # Open the LabJack U3
-    d = u3.U3()
+    d = device if device is not None else u3.U3()
     d.configIO(
         NumberOfTimersEnabled=1,
         EnableCounter1=1,
@@ -207,7 +280,7 @@ def main():
     )
     #set up the ljtickdac 
     dioPin = 6 
-    tdac = ljtickdac.LJTickDAC(d, dioPin)
+    tdac = ljtickdac.LJTickDAC(d, dioPin, cachePath='ljtickdac_cal.json')
 
     # Set the configuration for the first timer:
     t0Config = u3.TimerConfig(0, TimerMode=10, Value=0)
@@ -226,19 +299,49 @@ def main():
     csv.setFilename()
     pid_obj = PIDObject()
 
-    schedule.every(DIGI_TIME).seconds.do(pid_obj.updateDigiVoltage, d) 
+    stream = None
+    stream_writer = None
+    if (ACQUISITION == 'stream'):
+        stream = u3stream.U3StreamReader(d, [1], STREAM_RATE)
+        stream.on_block(pid_obj.addDigiVoltages)
+        if (STREAM_LOG):
+            stream_writer = datalogger.ColumnarWriter(
+                'Blower_Data/digihelic_stream_%m-%d-%Y.cols',
+                ['AIN1 Voltage'],
+                flush_rows=STREAM_RATE * FLUSH_TIME,
+                flush_interval=FLUSH_TIME,
+            )
+            stream.on_block(functools.partial(logStream, stream_writer))
+        stream.start()
+
+    feedback = u3feedback.FeedbackBatcher(d)
+    feedback.add('timer', timer)
+    feedback.add('counter', counter)
+    if (stream is None):
+        feedback.add_ain('digi', 1)
+
+    #tasks run at their real periods on the monotonic clock, a late task
+    #skips the runs it missed instead of bunching them up
+    tasks = scheduler.Scheduler()
+    if (stream is None):
+        tasks.every(DIGI_TIME, pid_obj.updateDigiVoltage, feedback)
     if (use_pid):
-        schedule.every(PID_TIME).seconds.do(runPID, pid_obj, tdac, d)
+        tasks.every(PID_TIME, runPID, pid_obj, tdac, d)
     else:
-        schedule.every(PID_TIME).seconds.do(runBlower, tdac, pid_obj)
-
-    schedule.every(WRITE_TIME).seconds.do(update_time_difference, csv, pid_obj, d, timer, counter)
+        tasks.every(PID_TIME, runBlower, tdac, pid_obj)
+    if (stream is None):
+        tasks.every(WRITE_TIME, update_time_difference, csv, pid_obj)
+    else:
+        tasks.every(WRITE_TIME, update_time_difference, csv, pid_obj, feedback)
     #runs serially, not in parallel 
-    #(only problem if run time greater than intervals), which it is not
 
-    while not stop_running: 
-        schedule.run_pending()
-        time.sleep(1)
+    tasks.run(stop=lambda: stop_running)
+    print(tasks.report())
+    if stream is not None:
+        stream.stop()
+    if stream_writer is not None:
+        stream_writer.close()
+    csv.writer.close()
 
 def stop_schedules():
     global stop_running
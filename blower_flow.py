@@ -0,0 +1,153 @@
+import argparse
+import glob
+import math
+import os
+
+import numpy as np
+
+INCH = 0.0254  # m
+PA_PER_INWC = 248.84
+
+
+class FlowConverter:
+    """Converts Digihelic voltages to blower flow rate (lpm).
+
+    The Digihelic current output is converted to differential pressure and
+    then to flow through the orifice with Bernoulli. All constants are
+    worked out once, and arrays of voltages are converted in one go.
+
+    """
+
+    NEGATIVE_POLICIES = ("clip", "signed", "nan", "raise")
+
+    def __init__(
+        self,
+        diameter=2 * INCH,
+        density=1.225,
+        ma_per_volt=8.475,
+        negative="clip",
+    ):
+        """diameter: Orifice diameter (m).
+        density: Air density (kg/m^3).
+        ma_per_volt: Digihelic loop current per LabJack volt (from the
+            LabJack website).
+        negative: What to do when the pressure reads below zero. "clip"
+            gives zero flow, "signed" gives negative flow, "nan" gives NaN
+            and "raise" raises a ValueError.
+
+        """
+        if negative not in self.NEGATIVE_POLICIES:
+            raise ValueError(f"Unknown negative pressure policy: {negative}")
+        self.negative = negative
+
+        # p_wc = (mA / 64) - (1 / 16), deltaP = p_wc * 248.84
+        self.pa_per_volt = ma_per_volt / 64 * PA_PER_INWC
+        self.pa_offset = -PA_PER_INWC / 16
+
+        # flow = area * sqrt(2 * deltaP / density), m^3/s to lpm
+        area = math.pi / 4 * diameter * diameter
+        self.lpm_per_sqrt_pa = area * math.sqrt(2 / density) * 60000
+
+    def pressure(self, volts):
+        """Returns the differential pressure (Pa) for the given voltages."""
+        return (
+            np.asarray(volts, dtype=float) * self.pa_per_volt + self.pa_offset
+        )
+
+    def __call__(self, volts):
+        """Returns the flow rate (lpm) for a voltage or array of voltages."""
+        delta_p = self.pressure(volts)
+        negative = delta_p < 0
+        if self.negative == "raise" and np.any(negative):
+            raise ValueError("Digihelic pressure is below zero")
+
+        flow = self.lpm_per_sqrt_pa * np.sqrt(np.abs(delta_p))
+        if self.negative == "clip":
+            flow = np.where(negative, 0.0, flow)
+        elif self.negative == "signed":
+            flow = np.where(negative, -flow, flow)
+        elif self.negative == "nan":
+            flow = np.where(negative, np.nan, flow)
+
+        if flow.ndim == 0:
+            return float(flow)
+        return flow
+
+    def volts(self, flow):
+        """Returns the Digihelic voltage that gives the flow rate (lpm)."""
+        flow = np.asarray(flow, dtype=float)
+        delta_p = np.sign(flow) * (flow / self.lpm_per_sqrt_pa) ** 2
+        return (delta_p - self.pa_offset) / self.pa_per_volt
+
+
+# Header of the raw blower logs, the rollup files next to them differ
+RAW_HEADER = "Voltage Sent,RPM,Flow Rate,Current Time"
+
+
+def reprocess(in_folder, out_folder, old, new):
+    """Recomputes the flow column of every raw blower CSV in a folder.
+
+    The Digihelic voltage of each row is recovered from the logged flow
+    rate with `old`, and converted back to flow with `new`. The output
+    files have the same columns plus the recovered Digihelic voltage.
+
+    """
+    os.makedirs(out_folder, exist_ok=True)
+    filenames = sorted(glob.glob(os.path.join(in_folder, "*.csv")))
+    for filename in filenames:
+        with open(filename, "r") as f:
+            header = f.readline().strip()
+        if header != RAW_HEADER:
+            continue
+        table = np.loadtxt(
+            filename, delimiter=",", skiprows=1, dtype=str, ndmin=2
+        )
+        if len(table) == 0:
+            continue
+
+        digi_volts = old.volts(table[:, 2].astype(float))
+        flow = new(digi_volts)
+        table = np.column_stack(
+            [
+                table[:, :2],
+                flow.astype(str),
+                table[:, 3:],
+                digi_volts.astype(str),
+            ]
+        )
+
+        out_path = os.path.join(out_folder, os.path.basename(filename))
+        np.savetxt(
+            out_path,
+            table,
+            fmt="%s",
+            delimiter=",",
+            header=header + ",Digihelic Voltage",
+            comments="",
+        )
+        print(f"{filename}: {len(table)} rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reprocess logged blower flow with new calibration"
+    )
+    parser.add_argument("in_folder", nargs="?", default="Blower_Data")
+    parser.add_argument("out_folder", nargs="?", default="Blower_Reprocessed")
+    parser.add_argument("--diameter", type=float, default=2 * INCH)
+    parser.add_argument("--density", type=float, default=1.225)
+    parser.add_argument("--ma-per-volt", type=float, default=8.475)
+    parser.add_argument(
+        "--negative",
+        choices=FlowConverter.NEGATIVE_POLICIES,
+        default="clip",
+    )
+    args = parser.parse_args()
+
+    new = FlowConverter(
+        diameter=args.diameter,
+        density=args.density,
+        ma_per_volt=args.ma_per_volt,
+        negative=args.negative,
+    )
+    reprocess(args.in_folder, args.out_folder, FlowConverter(), new)
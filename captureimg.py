@@ -1,34 +1,87 @@
 import cv2
+import functools
 from PIL import Image, ImageDraw, ImageFont
 import time
 import datetime
 import numpy as np
 import os
-import io
-import sys
 
+# Tried in order, arial.ttf is missing on Linux
+FONTS = ("arial.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf")
 
-def add_timestamp(image):
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    pil_image = Image.fromarray(image)
-    draw = ImageDraw.Draw(pil_image)
-    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    font_size = 30
-    font = ImageFont.truetype("arial.ttf", font_size)
-    text_position = (image.shape[1] - 300, image.shape[0] - 50)
-    draw.text(text_position, current_time, (255, 255, 255), font=font)
-    image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-    return image
+
+def load_font(size, fonts=FONTS):
+    """The first of fonts that can be loaded, or PIL's built-in font."""
+    for name in fonts:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:  # Pillow < 10.1 has only the fixed bitmap font
+        return ImageFont.load_default()
+
+
+class TextOverlay:
+    """Draws text onto BGR frames in place.
+
+    Each character is rendered once with PIL into an alpha mask, so a
+    frame only gets the masks of its text blended into the small region
+    under it, without converting or copying the whole frame.
+
+    """
+
+    def __init__(self, font_size=30, color=(255, 255, 255)):
+        """color: Text color as BGR."""
+        self.font = load_font(font_size)
+        self.color = np.array(color, np.uint16)
+        if hasattr(self.font, "getmetrics"):
+            ascent, descent = self.font.getmetrics()
+            self.height = ascent + descent
+        else:
+            # PIL's bitmap font has no metrics, measure the tallest glyphs
+            self.height = self.font.getbbox("Ag|")[3]
+        self._glyphs = {}
+
+    def glyph(self, char):
+        """Alpha mask of char, its advance wide and the line high."""
+        mask = self._glyphs.get(char)
+        if mask is None:
+            width = max(1, round(self.font.getlength(char)))
+            glyph = Image.new("L", (width, self.height))
+            ImageDraw.Draw(glyph).text((0, 0), char, 255, font=self.font)
+            mask = self._glyphs[char] = np.asarray(glyph)
+        return mask
+
+    def draw(self, image, text, position):
+        """Draws text with its top left corner at position (x, y), clipped
+        to the image.
+
+        """
+        alpha = np.hstack([self.glyph(char) for char in text])
+        x, y = position
+        left, top = max(x, 0), max(y, 0)
+        roi = image[top : y + alpha.shape[0], left : x + alpha.shape[1]]
+        alpha = alpha[top - y :, left - x :][: roi.shape[0], : roi.shape[1]]
+        alpha = alpha[..., None].astype(np.uint16)
+        roi[...] = (roi * (255 - alpha) + self.color * alpha + 127) // 255
+        return image
+
+
+@functools.cache
+def timestamp_overlay():
+    return TextOverlay(font_size=30)
 
 
-# Initialize the webcam
-cap = cv2.VideoCapture(0)
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
+def add_timestamp(image):
+    """Draws the current time in the bottom right corner of the BGR
+    image, in place, and returns the image.
 
-# Create a root directory 'images' if not exists
-if not os.path.exists("images"):
-    os.makedirs("images")
+    """
+    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    text_position = (image.shape[1] - 300, image.shape[0] - 50)
+    return timestamp_overlay().draw(image, current_time, text_position)
 
 
 class WebcamError(Exception):
@@ -41,73 +94,103 @@ def write_to_log(folder_path, message):
         log_file.write(message + "\n")
 
 
-while True:
-    current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-    folder_path = os.path.join("images", current_date)
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
+def open_camera():
+    # Initialize the webcam
+    cap = cv2.VideoCapture(0)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
+    return cap
+
+
+def main(headless=False, interval=5, stop_event=None):
+    """Saves a timestamped webcam image every `interval` seconds. The live
+    preview window is only shown when not headless. Runs until interrupted
+    or stop_event (a threading.Event) is set.
+
+    """
+    cap = open_camera()
+
+    # Create a root directory 'images' if not exists
+    if not os.path.exists("images"):
+        os.makedirs("images")
 
     try:
-        start_time = time.time()
+        while stop_event is None or not stop_event.is_set():
+            current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+            folder_path = os.path.join("images", current_date)
+            if not os.path.exists(folder_path):
+                os.makedirs(folder_path)
+
+            try:
+                start_time = time.time()
+
+                ret, frame = cap.read()
 
-        ret, frame = cap.read()
+                if not ret:
+                    raise WebcamError("Failed to grab frame")
 
-        if not ret:
-            raise WebcamError("Failed to grab frame")
+                frame_with_timestamp = add_timestamp(frame)
+                # current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+                # folder_path = os.path.join("images", current_date)
 
-        frame_with_timestamp = add_timestamp(frame)
-        display_frame = cv2.resize(frame_with_timestamp, (640, 360))
-        # current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        # folder_path = os.path.join("images", current_date)
+                # if not os.path.exists(folder_path):
+                #     os.makedirs(folder_path)
 
-        # if not os.path.exists(folder_path):
-        #     os.makedirs(folder_path)
+                filename = f"{folder_path}/image_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
+                cv2.imwrite(filename, frame_with_timestamp)
+                if not headless:
+                    display_frame = cv2.resize(
+                        frame_with_timestamp, (640, 360)
+                    )
+                    cv2.imshow("Webcam", display_frame)
 
-        filename = f"{folder_path}/image_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-        cv2.imwrite(filename, frame_with_timestamp)
-        cv2.imshow("Webcam", display_frame)
+                end_time = time.time()
+                elapsed_time = end_time - start_time
+                sleep_time = interval - elapsed_time
 
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        sleep_time = 5 - elapsed_time
+                if sleep_time > 0 and stop_event is not None:
+                    stop_event.wait(sleep_time)
+                elif sleep_time > 0:
+                    time.sleep(sleep_time)
 
-        if sleep_time > 0:
-            time.sleep(sleep_time)
+                if not headless and cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
 
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
+            except WebcamError as we:
+                current_timestamp = datetime.datetime.now().strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                )
+                error_message = f"{current_timestamp}: Webcam error"
 
-    except WebcamError as we:
-        current_timestamp = datetime.datetime.now().strftime(
-            "%Y-%m-%d %H:%M:%S"
-        )
-        error_message = f"{current_timestamp}: Webcam error"
+                # Print to screen
+                print(error_message)
 
-        # Print to screen
-        print(error_message)
+                # Write to log
+                write_to_log(folder_path, error_message)
 
-        # Write to log
-        write_to_log(folder_path, error_message)
+                # Attempt to re-initialize the webcam
+                cap.release()
+                time.sleep(2)
+                cap = open_camera()
 
-        # Attempt to re-initialize the webcam
-        cap.release()
-        time.sleep(2)
-        cap = cv2.VideoCapture(0)
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
+            except Exception as e:
+                current_timestamp = datetime.datetime.now().strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                )
+                error_message = f"{current_timestamp}: {str(e)}"
 
-    except Exception as e:
-        current_timestamp = datetime.datetime.now().strftime(
-            "%Y-%m-%d %H:%M:%S"
-        )
-        error_message = f"{current_timestamp}: {str(e)}"
+                # Print to screen
+                print(error_message)
 
-        # Print to screen
-        print(error_message)
+                # Write to log
+                write_to_log(folder_path, error_message)
+    except KeyboardInterrupt:
+        pass
 
-        # Write to log
-        write_to_log(folder_path, error_message)
+    cap.release()
+    if not headless:
+        cv2.destroyAllWindows()
 
 
-cap.release()
-cv2.destroyAllWindows()
+if __name__ == "__main__":
+    main()
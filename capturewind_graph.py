@@ -1,17 +1,42 @@
 import serial
 import time
-import os
-import tkinter as tk
-from tkinter import ttk
+import queue
+from collections import deque
 import numpy as np
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import datalogger
+import serialstream
+import windstats
 
 
 class WindDataLogger:
-    def __init__(self, root, port="COM3"):
+    def __init__(
+        self,
+        root=None,
+        port="COM3",
+        log_backend="csv",
+        flush_rows=60,
+        flush_interval=10.0,
+        redraw_interval=1000,
+        rose_minutes=None,
+        rmax=10.0,
+        summary_interval=60,
+        rollups=(60, 3600),
+    ):
+        """root: Tk root window, the logger runs headless if None.
+        redraw_interval: Milliseconds between plot redraws, independent of
+            the sample rate.
+        rose_minutes: Also draw a wind rose of the last this many minutes.
+        rmax: Initial radial limit (m/s), raised if the wind exceeds it.
+        summary_interval: Seconds between rows of the windowed statistics
+            in the windsummary file.
+        rollups: Seconds per row of the averaged files kept next to the
+            raw log, the direction is averaged as a vector.
+
+        """
         self.root = root
-        self.root.title("Wind Data Logger")
+        self.redraw_interval = redraw_interval
+        self.rmax = rmax
+        self.rose = WindRose(rose_minutes) if rose_minutes else None
 
         self.ser = serial.Serial(
             port,
@@ -22,18 +47,62 @@ class WindDataLogger:
             parity=serial.PARITY_NONE,
         )
 
-        # For logging
-        self.current_date = time.strftime("%Y%m%d")
-        # For rolling average
-        self.data_buffer = []
+        # For logging, a new file is started in 'anemometer' each day
+        self.log_writer = datalogger.open_writer(
+            "anemometer/windspeed_%Y%m%d.csv",
+            [
+                "Timestamp",
+                "Sensor Address",
+                "Windspeed (m/s)",
+                "Wind Direction",
+                "Status",
+            ],
+            backend=log_backend,
+            skip=["Timestamp"],
+            flush_rows=flush_rows,
+            flush_interval=flush_interval,
+            rollups=rollups,
+            angles=["Wind Direction"],
+            rollup_skip=["Sensor Address", "Status"],
+        )
+        # Running vector averages over 8 samples, 1 min, 10 min and 1 h,
+        # logged every summary_interval to a separate daily file
+        self.stats = windstats.WindStatistics()
+        self.current = None
+        self.summary_interval = summary_interval
+        self.next_summary = None
+        self.summary_writer = datalogger.open_writer(
+            "anemometer/windsummary_%Y%m%d.csv",
+            ["Timestamp"] + self.stats.header(),
+            backend=log_backend,
+            skip=["Timestamp"],
+            flush_rows=flush_rows,
+            flush_interval=flush_interval,
+        )
 
-        # Setup GUI components
-        self.setup_gui()
+        # Frames are read and parsed on a background thread, so a quiet
+        # sensor never blocks the GUI
+        self.reader = serialstream.SerialReader(
+            self.ser, serialstream.FrameParser(parse_frame)
+        ).start()
 
-        # Schedule data collection
-        self.root.after(250, self.collect_data)
+        # Without a root window the logger runs headless through run()
+        if self.root is not None:
+            self.root.title("Wind Data Logger")
+
+            # Setup GUI components
+            self.setup_gui()
+
+            # Schedule data collection and plot redraws
+            self.root.after(250, self.collect_data)
+            self.root.after(self.redraw_interval, self.redraw)
 
     def setup_gui(self):
+        # Only load Tk widgets and matplotlib when there is a display
+        from tkinter import ttk
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         # # Display area for windspeed and direction
         # self.lbl_windspeed = ttk.Label(self.root, text="Windspeed (m/s): ")
         # self.lbl_windspeed.grid(row=0, column=0, sticky="w", pady=5, padx=5)
@@ -46,9 +115,32 @@ class WindDataLogger:
         self.ax = self.figure.add_subplot(111, projection="polar")
         self.ax.set_theta_zero_location("N")  # 0 degrees at the top
         self.ax.set_theta_direction(-1)  # Clockwise
+        self.ax.set_ylim(0, self.rmax)
         self.canvas = FigureCanvasTkAgg(self.figure, self.root)
         self.canvas.get_tk_widget().grid(row=2, column=0, padx=5, pady=5)
 
+        # The bars are created once and updated in place. They are drawn
+        # over a cached background of the axes, which is only re-rendered
+        # when the figure is redrawn (resize, radial limit change).
+        self.rose_bars = []
+        if self.rose is not None:
+            self.rose_bars = self.ax.bar(
+                self.rose.angles,
+                np.zeros(self.rose.sectors),
+                width=2 * np.pi / self.rose.sectors,
+                color="gray",
+                alpha=0.3,
+                animated=True,
+            ).patches
+        self.bar = self.ax.bar(
+            [0.0], [0.0], width=0.1, alpha=0.6, animated=True
+        ).patches[
+            0
+        ]  # Set width for a narrower bar
+        self.background = None
+        self.plot_dirty = False
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
         # Labels to display current wind speed and direction below the graph
         self.lbl_current_windspeed = ttk.Label(self.root, text="")
         self.lbl_current_winddirection = ttk.Label(self.root, text="")
@@ -61,106 +153,211 @@ class WindDataLogger:
         )
         self.btn_close.grid(row=5, column=0, pady=10)
 
-    def get_log_filename(self):
-        # Create a folder named 'anemometer' if it doesn't exist
-        if not os.path.exists("anemometer"):
-            os.makedirs("anemometer")
-
-        # Generate the filename based on the current date
-        filename = time.strftime(
-            "windspeed_%Y%m%d.csv"
-        )  # Change the extension to .csv
-        return os.path.join("anemometer", filename)
-
-    def log_data(self, data):
-        log_filename = self.get_log_filename()
+    def log_data(self, data, timestamp=None):
+        self.log_writer.writerow([time.ctime(timestamp)] + data.split())
 
-        # If the date changes, reset the current date
-        if self.current_date != time.strftime("%Y%m%d"):
-            self.current_date = time.strftime("%Y%m%d")
+    def on_draw(self, event):
+        """Caches the background after a full redraw."""
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_artists()
 
-        # Open the log file for the day
-        with open(log_filename, "a") as f:
-            # If the file is new/empty, add the header
-            if f.tell() == 0:
-                header = "Timestamp, Sensor Address, Windspeed (m/s), Wind Direction, Status\n"  # Added Timestamp column
-                f.write(header)
-
-            formatted_data = f"{time.ctime()}, {', '.join(data.split())}\n"
-            f.write(formatted_data)
+    def draw_artists(self):
+        for bar in self.rose_bars:
+            self.ax.draw_artist(bar)
+        self.ax.draw_artist(self.bar)
 
     def update_plot(self):
-        self.ax.clear()
-
-        if len(self.data_buffer) >= 8:
-            windspeeds = [entry[0] for entry in self.data_buffer[-8:]]
-            wind_directions = [
-                np.deg2rad(entry[1]) for entry in self.data_buffer[-8:]
-            ]
-            avg_speed = np.mean(windspeeds)
-            avg_direction = np.mean(wind_directions)
-
-            self.ax.bar(
-                avg_direction, avg_speed, width=0.1, alpha=0.6
-            )  # Set width for a narrower bar
+        top = 0.0
+        count, avg_speed, _, avg_direction, _ = self.stats.summary("8 samples")
+        if count >= 8:
+            self.bar.set_x(
+                np.deg2rad(avg_direction) - self.bar.get_width() / 2
+            )
+            self.bar.set_height(avg_speed)
+            top = avg_speed
 
             # Update labels below the graph
-            self.lbl_current_windspeed[
-                "text"
-            ] = f"Current Windspeed: {windspeeds[-1]:.2f} m/s"
-            self.lbl_current_winddirection[
-                "text"
-            ] = f"Current Wind Direction: {wind_directions[-1]*180/np.pi:.2f}°"
-
-        self.canvas.draw()
+            windspeed, wind_direction = self.current
+            self.lbl_current_windspeed["text"] = (
+                f"Current Windspeed: {windspeed:.2f} m/s"
+            )
+            self.lbl_current_winddirection["text"] = (
+                f"Current Wind Direction: {wind_direction:.2f}°"
+            )
+
+        if self.rose is not None:
+            for bar, speed in zip(
+                self.rose_bars, self.rose.means(time.time())
+            ):
+                bar.set_height(speed)
+                top = max(top, speed)
+
+        if top > self.ax.get_ylim()[1]:
+            # Full redraw with a new radial limit, on_draw re-caches
+            self.ax.set_ylim(0, 1.25 * top)
+            self.canvas.draw_idle()
+        elif self.background is None:
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_artists()
+            self.canvas.blit(self.ax.bbox)
+
+    def redraw(self):
+        """Redraws the plot if new data arrived since the last redraw."""
+        if self.plot_dirty:
+            self.plot_dirty = False
+            self.update_plot()
+        self.root.after(self.redraw_interval, self.redraw)
 
     def close_app(self):
+        self.reader.stop()
         self.ser.close()  # Close the serial port
-        self.root.quit()
+        self.log_writer.close()
+        self.summary_writer.close()
+        if self.root is not None:
+            self.root.quit()
+
+    def add_record(self, timestamp, record):
+        """Logs one parsed frame and adds it to the statistics."""
+        data, windspeed, wind_direction = record
+
+        # Log the data to file
+        self.log_data(data, timestamp)
+
+        # Save data for plotting
+        self.current = (windspeed, wind_direction)
+        self.stats.add(timestamp, windspeed, wind_direction)
+        if self.next_summary is None or timestamp >= self.next_summary:
+            if self.next_summary is not None:
+                self.log_summary(timestamp)
+            self.next_summary = (
+                timestamp // self.summary_interval + 1
+            ) * self.summary_interval
+        if self.rose is not None:
+            self.rose.add(timestamp, windspeed, wind_direction)
+
+    def log_summary(self, timestamp):
+        self.summary_writer.writerow(
+            [time.ctime(timestamp)] + self.stats.row(timestamp)
+        )
+
+    def read_sample(self, timeout=1.0):
+        """Waits up to timeout seconds for a record, then logs and buffers
+        it. Returns False if none arrived.
+
+        """
+        try:
+            timestamp, record = self.reader.get(timeout)
+        except queue.Empty:
+            return False
+        self.add_record(timestamp, record)
+        return True
+
+    def run(self):
+        """Logs each record as it arrives, without a GUI, until interrupted
+        or stop() is called.
+
+        """
+        self.running = True
+        try:
+            while self.running:
+                self.read_sample(timeout=0.25)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close_app()
+
+    def stop(self):
+        self.running = False
 
     def collect_data(self):
-        start_time = time.time()
+        # Take everything the reader has queued, without waiting
+        records = self.reader.drain()
+        for timestamp, record in records:
+            self.add_record(timestamp, record)
+        if records:
+            self.plot_dirty = True
+
+        self.root.after(250, self.collect_data)
 
-        data = self.read_data_until(b"\r")
-        if data:
-            # Extract and display data
-            _, windspeed, wind_direction, _ = data.split()
-            # self.lbl_windspeed["text"] = f"Windspeed (m/s): {windspeed}"
-            # self.lbl_winddirection["text"] = f"Wind Direction: {wind_direction}"
 
-            # Log the data to file
-            self.log_data(data)
+class WindRose:
+    """Mean wind speed per direction sector over the last `minutes`.
+
+    Sector sums and counts are updated as samples arrive and expire, so
+    drawing it doesn't rescan the history.
+
+    """
+
+    def __init__(self, minutes, sectors=16):
+        self.span = minutes * 60
+        self.sectors = sectors
+        self.angles = np.arange(sectors) * 2 * np.pi / sectors
+        self.counts = np.zeros(sectors)
+        self.sums = np.zeros(sectors)
+        self.samples = deque()
+
+    def add(self, timestamp, speed, direction):
+        sector = int(round(direction / 360 * self.sectors)) % self.sectors
+        self.samples.append((timestamp, sector, speed))
+        self.counts[sector] += 1
+        self.sums[sector] += speed
+        self.expire(timestamp)
+
+    def expire(self, now):
+        while self.samples and self.samples[0][0] <= now - self.span:
+            _, sector, speed = self.samples.popleft()
+            self.counts[sector] -= 1
+            self.sums[sector] -= speed
+
+    def means(self, now):
+        """Mean speed per sector, 0 for sectors without samples."""
+        self.expire(now)
+        return np.divide(
+            self.sums,
+            self.counts,
+            out=np.zeros(self.sectors),
+            where=self.counts > 0,
+        )
 
-            # Save data for plotting
-            self.data_buffer.append((float(windspeed), float(wind_direction)))
-            if len(self.data_buffer) > 8:
-                self.data_buffer.pop(0)
 
-            self.update_plot()
+def parse_frame(text):
+    """Parses an "address speed direction status" frame into (text,
+    windspeed, direction), raising ValueError if it is malformed. Only the
+    last four fields are used, so line noise before a frame is dropped.
 
-            # Force an update to the GUI
-            self.root.update_idletasks()
+    """
+    fields = text.split()[-4:]
+    if len(fields) != 4:
+        raise ValueError(f"Expected 4 fields: {text!r}")
+    return " ".join(fields), float(fields[1]), float(fields[2])
 
-        elapsed_time = time.time() - start_time
-        sleep_duration = max(250 - (elapsed_time * 1000), 0)
-        self.root.after(int(sleep_duration), self.collect_data)
 
-    def read_data_until(self, delimiter):
-        buffer = b""
-        while True:
-            char = self.ser.read(1)  # Read a single byte
-            if char:
-                buffer += char
-                if buffer.endswith(
-                    delimiter
-                ):  # If the delimiter is found, break the loop
-                    break
-            else:  # If there's a long pause (no data), then clear the buffer to avoid stale data accumulation.
-                buffer = b""
-        return buffer.decode("utf-8").strip()
+def main(
+    headless=False,
+    port="COM3",
+    log_backend="csv",
+    redraw_interval=1000,
+    rose_minutes=None,
+):
+    """Runs the wind logger, with the polar plot unless headless."""
+    if headless:
+        WindDataLogger(port=port, log_backend=log_backend).run()
+        return
 
+    import tkinter as tk
 
-if __name__ == "__main__":
     root = tk.Tk()
-    app = WindDataLogger(root)
+    app = WindDataLogger(
+        root,
+        port=port,
+        log_backend=log_backend,
+        redraw_interval=redraw_interval,
+        rose_minutes=rose_minutes,
+    )
     root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
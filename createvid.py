@@ -1,9 +1,20 @@
+import argparse
 import cv2
+import functools
+import itertools
+import json
 import os
+import shutil
+import subprocess
 import tkinter as tk
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import filedialog
 from datetime import datetime, timedelta
 
+import numpy as np
+from PIL import Image
+
 
 def select_folder(title="Select a folder"):
     folder_selected = filedialog.askdirectory(title=title)
@@ -24,60 +35,392 @@ def log_to_file(log_file, message):
         f.write(message + "\n")
 
 
-def create_timelapse(input_folder, output_folder, fps=30):
+def read_frames(paths, workers=None, prefetch=None, read=cv2.imread):
+    """Yields the decoded images of `paths` in order.
+
+    A thread pool decodes up to `prefetch` frames ahead of the consumer,
+    so JPEG decoding (which releases the GIL) runs on several cores while
+    the caller encodes, and no more than `prefetch` decoded frames wait in
+    memory.
+
+    workers: Decode threads, defaults to the number of CPUs.
+    prefetch: Frames decoded ahead, defaults to twice the workers.
+
+    """
+    workers = workers or os.cpu_count() or 1
+    prefetch = prefetch or 2 * workers
+    paths = iter(paths)
+    pool = ThreadPoolExecutor(workers)
+    pending = deque()
+    try:
+        for path in paths:
+            pending.append(pool.submit(read, path))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            frame = pending.popleft().result()
+            path = next(paths, None)
+            if path is not None:
+                pending.append(pool.submit(read, path))
+            yield frame
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class FrameManifest:
+    """Index of the images in one folder: the timestamp parsed from each
+    filename, its size, and whether its header could be read.
+
+    It is saved as manifest.json in the folder, so a later run only probes
+    the files added or rewritten since (by file size and mtime), and the
+    ones that were unreadable, which captureimg.py may have been writing.
+
+    """
+
+    FILENAME = "manifest.json"
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, self.FILENAME)
+        self.frames = {}
+        try:
+            with open(self.path) as f:
+                self.frames = json.load(f)["frames"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def update(self):
+        """Probes the images that are new, changed or were unreadable, and
+        forgets deleted ones, returns the names of the probed images.
+
+        """
+        seen = set()
+        new = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                name = entry.name
+                if not name.endswith((".png", ".jpg")):
+                    continue
+                seen.add(name)
+                stat = entry.stat()
+                frame = self.frames.get(name)
+                if (
+                    frame is None
+                    or not frame["valid"]
+                    or frame.get("bytes") != stat.st_size
+                    or frame.get("mtime") != stat.st_mtime_ns
+                ):
+                    self.frames[name] = probe_frame(entry.path, stat)
+                    new.append(name)
+        for name in set(self.frames) - seen:
+            del self.frames[name]
+        return sorted(new)
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"frames": self.frames}, f)
+        os.replace(temp_path, self.path)
+
+    def valid_frames(self):
+        """Names of the readable images, sorted by name."""
+        return sorted(
+            name for name, frame in self.frames.items() if frame["valid"]
+        )
+
+    def timestamp(self, name):
+        timestamp = self.frames[name]["timestamp"]
+        return datetime.fromisoformat(timestamp) if timestamp else None
+
+    def gaps(self, names, minimum=timedelta(minutes=30)):
+        """Yields (start, end) for consecutive names further apart than
+        minimum.
+
+        """
+        previous = None
+        for name in names:
+            timestamp = self.timestamp(name)
+            if previous and timestamp and timestamp - previous > minimum:
+                yield previous, timestamp
+            previous = timestamp or previous
+
+
+def probe_frame(path, stat=None):
+    """Manifest entry of one image, reading only its header.
+
+    stat: os.stat() of path, if already known.
+
+    """
+    stat = stat or os.stat(path)
+    timestamp = extract_timestamp(os.path.basename(path))
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+        valid = True
+    except OSError:
+        width = height = None
+        valid = False
+    return {
+        "timestamp": timestamp.isoformat() if timestamp else None,
+        "width": width,
+        "height": height,
+        "valid": valid,
+        "bytes": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+    }
+
+
+# Encoder name to (file extension, ffmpeg codec)
+ENCODERS = {
+    "xvid": (".avi", None),
+    "x264": (".mp4", "libx264"),
+    "x265": (".mp4", "libx265"),
+}
+
+
+def resolve_encoder(encoder):
+    """Returns the ENCODERS name for encoder, where "auto" is x264 when
+    ffmpeg is on the PATH and OpenCV's XVID otherwise.
+
+    """
+    if encoder == "auto":
+        return "x264" if shutil.which("ffmpeg") else "xvid"
+    if encoder not in ENCODERS:
+        raise ValueError(f"Unknown encoder {encoder!r}")
+    return encoder
+
+
+class FFmpegWriter:
+    """Pipes raw BGR frames to an ffmpeg process encoding H.264 or H.265,
+    with the write() and release() of a cv2.VideoWriter.
+
+    Encoding runs in the ffmpeg process on `threads` threads, in parallel
+    with the decoding in this one.
+
+    """
+
+    def __init__(
+        self,
+        path,
+        fps,
+        size,
+        codec="libx264",
+        preset="medium",
+        crf=23,
+        threads=0,
+    ):
+        """path: Output video file, its extension picks the container.
+        size: Frame (width, height).
+        codec: libx264 or libx265.
+        preset: x264/x265 speed preset, ultrafast to veryslow.
+        crf: Constant rate factor, lower is better quality and larger.
+        threads: Encoder threads, 0 for one per core.
+
+        """
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise FileNotFoundError("ffmpeg isn't on the PATH")
+        width, height = size
+        self.size = size
+        # yuv420p needs even dimensions
+        command = (
+            [ffmpeg, "-v", "error", "-y", "-f", "rawvideo"]
+            + ["-pix_fmt", "bgr24", "-s", f"{width}x{height}"]
+            + ["-r", str(fps), "-i", "-"]
+            + ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+            + ["-c:v", codec, "-preset", preset, "-crf", str(crf)]
+            + ["-threads", str(threads), "-pix_fmt", "yuv420p", path]
+        )
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, img):
+        self.process.stdin.write(np.ascontiguousarray(img).data)
+
+    def release(self):
+        self.process.stdin.close()
+        if self.process.wait():
+            raise subprocess.CalledProcessError(
+                self.process.returncode, self.process.args
+            )
+
+
+def open_video_writer(
+    path, fps, size, encoder="xvid", preset="medium", crf=23, threads=0
+):
+    """Returns a writer for path with write(img) and release(), an
+    FFmpegWriter for x264/x265 and a cv2.VideoWriter for xvid.
+
+    """
+    encoder = resolve_encoder(encoder)
+    codec = ENCODERS[encoder][1]
+    if codec is None:
+        fourcc = cv2.VideoWriter_fourcc(*"XVID")
+        return cv2.VideoWriter(path, fourcc, fps, size)
+    return FFmpegWriter(path, fps, size, codec, preset, crf, threads)
+
+
+def join_segments(segments, output_path):
+    """Joins the segment videos into output_path without re-encoding
+    them, which takes ffmpeg for more than one segment.
+
+    """
+    root, extension = os.path.splitext(output_path)
+    temp_path = root + ".tmp" + extension
+    if len(segments) == 1:
+        shutil.copyfile(segments[0], temp_path)
+    else:
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise FileNotFoundError("Joining segments needs ffmpeg")
+        list_path = output_path + ".txt"
+        with open(list_path, "w") as f:
+            for segment in segments:
+                f.write(f"file '{os.path.abspath(segment)}'\n")
+        subprocess.run(
+            [ffmpeg, "-v", "error", "-y", "-f", "concat", "-safe", "0"]
+            + ["-i", list_path, "-c", "copy", temp_path],
+            check=True,
+        )
+        os.remove(list_path)
+    os.replace(temp_path, output_path)
+
+
+def create_timelapse(
+    input_folder,
+    output_folder,
+    fps=30,
+    workers=None,
+    prefetch=None,
+    incremental=True,
+    encoder="auto",
+    preset="medium",
+    crf=23,
+    threads=0,
+):
+    """Encodes the images in input_folder into a timelapse video.
+
+    The frames are indexed in the folder's FrameManifest, and the video is
+    built from segments kept in a folder next to it, one per run, so a
+    re-run only decodes and encodes the frames added since the last one.
+    Joining the segments needs ffmpeg; without it the video is rebuilt
+    from every frame each run.
+    The first frame's size is kept for every segment.
+
+    incremental: False to rebuild the video from every frame.
+    encoder: A name in ENCODERS or "auto", see resolve_encoder(). The
+        preset, crf and threads options go to an FFmpegWriter.
+
+    """
     # Extract the folder name, which is assumed to be a date
-    date_str = os.path.basename(input_folder)
+    date_str = os.path.basename(os.path.normpath(input_folder))
 
     # Output video file name
-    output_path = os.path.join(output_folder, f"timelapse_{date_str}.avi")
+    encoder = resolve_encoder(encoder)
+    extension = ENCODERS[encoder][0]
+    output_path = os.path.join(
+        output_folder, f"timelapse_{date_str}{extension}"
+    )
     log_file_path = os.path.join(output_folder, f"log_{date_str}.txt")
+    segment_folder = os.path.join(
+        output_folder, f"timelapse_{date_str}_segments"
+    )
+    state_path = os.path.join(segment_folder, "segments.json")
 
-    # Get all files from the folder
-    images = [
-        img
-        for img in os.listdir(input_folder)
-        if img.endswith(".png") or img.endswith(".jpg")
-    ]
-
-    # Sort the images by name
-    images.sort()
-
-    # Log the timestamp of the first and last frame
-    first_timestamp = extract_timestamp(images[0])
-    last_timestamp = extract_timestamp(images[-1])
-    log_to_file(log_file_path, f"First frame timestamp: {first_timestamp}")
-    log_to_file(log_file_path, f"Last frame timestamp: {last_timestamp}")
-
-    # Check for time gaps more than 30 minutes and log
-    for i in range(len(images) - 1):
-        current_timestamp = extract_timestamp(images[i])
-        next_timestamp = extract_timestamp(images[i + 1])
-
-        if next_timestamp - current_timestamp > timedelta(minutes=30):
-            log_to_file(
-                log_file_path,
-                f"Gap detected: {current_timestamp} to {next_timestamp}",
-            )
+    # Index the files added since the last run
+    manifest = FrameManifest(input_folder)
+    manifest.update()
+    manifest.save()
+    images = manifest.valid_frames()
+    if not images:
+        print("No images found.")
+        return
 
-    # Read the first image to get dimensions
-    img = cv2.imread(os.path.join(input_folder, images[0]))
-    height, width, layers = img.shape
+    # Frames already in the video, if they are still the first ones
+    state = None
+    if incremental and os.path.exists(output_path):
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        if state and (
+            state["frames"] > len(images)
+            or images[state["frames"] - 1] != state["last"]
+            or state["fps"] != fps
+            or state.get("encoder", "xvid") != encoder
+        ):
+            state = None
+        if (
+            state
+            and state["frames"] < len(images)
+            and not shutil.which("ffmpeg")
+        ):
+            # Re-encoding the old segments would cost as much as this
+            message = "ffmpeg not found, rebuilding the whole video"
+            print(message)
+            log_to_file(log_file_path, message)
+            state = None
+    if state is None:
+        shutil.rmtree(segment_folder, ignore_errors=True)
+        first = manifest.frames[images[0]]
+        state = {
+            "frames": 0,
+            "last": None,
+            "fps": fps,
+            "encoder": encoder,
+            "size": [first["width"], first["height"]],
+            "segments": [],
+        }
+        log_to_file(
+            log_file_path,
+            f"First frame timestamp: {manifest.timestamp(images[0])}",
+        )
+    new_images = images[state["frames"] :]
+    if not new_images:
+        print("No new images.")
+        return
+
+    # Log the time gaps of more than 30 minutes before the new frames
+    start = max(state["frames"] - 1, 0)
+    for current_timestamp, next_timestamp in manifest.gaps(images[start:]):
+        log_to_file(
+            log_file_path,
+            f"Gap detected: {current_timestamp} to {next_timestamp}",
+        )
+    log_to_file(
+        log_file_path,
+        f"Last frame timestamp: {manifest.timestamp(images[-1])}",
+    )
 
-    # Create a VideoCapture object
-    fourcc = cv2.VideoWriter_fourcc(*"XVID")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    # Encode the new frames into a segment of their own
+    os.makedirs(segment_folder, exist_ok=True)
+    segment_path = os.path.join(
+        segment_folder, f"{len(state['segments']):03d}{extension}"
+    )
+    width, height = state["size"]
+    out = open_video_writer(
+        segment_path, fps, (width, height), encoder, preset, crf, threads
+    )
 
-    total_images = len(images)
+    total_images = len(new_images)
     last_percentage = 0
     progress_bar_length = 20  # Length of the progress bar in blocks
 
     # Initialize progress bar
     progress_bar = "-" * progress_bar_length
 
-    # Loop through image files to create video
-    for i in range(total_images):
-        img = cv2.imread(os.path.join(input_folder, images[i]))
-        out.write(img)
+    # Loop through image files to create video, decoding ahead on a pool
+    frames = read_frames(
+        [os.path.join(input_folder, image) for image in new_images],
+        workers,
+        prefetch,
+    )
+    for i, img in enumerate(frames):
+        if img is None:
+            log_to_file(log_file_path, f"Unreadable frame: {new_images[i]}")
+        else:
+            # VideoWriter drops frames of any other size
+            out.write(fit_frame(img, (width, height)))
 
         # Calculate progress as a percentage
         progress = int((i + 1) / total_images * 100)
@@ -92,11 +435,241 @@ def create_timelapse(input_folder, output_folder, fps=30):
             last_percentage = progress
 
     out.release()
-    cv2.destroyAllWindows()
+
+    state["segments"].append(os.path.basename(segment_path))
+    join_segments(
+        [os.path.join(segment_folder, name) for name in state["segments"]],
+        output_path,
+    )
+    state["frames"] = len(images)
+    state["last"] = images[-1]
+    with open(state_path, "w") as f:
+        json.dump(state, f)
     print("Timelapse creation complete!")
 
 
+# cv2.imread flags decoding JPEGs at 1/n scale, which skips most of the
+# IDCT work
+REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def date_folders(images_folder, start=None, end=None):
+    """The YYYY-MM-DD folders in images_folder from start to end
+    (inclusive, as dates or YYYY-MM-DD strings), in date order.
+
+    """
+    start, end = str(start or ""), str(end or "9999-12-31")
+    folders = []
+    for name in sorted(os.listdir(images_folder)):
+        try:
+            datetime.strptime(name, "%Y-%m-%d")
+        except ValueError:
+            continue
+        path = os.path.join(images_folder, name)
+        if start <= name <= end and os.path.isdir(path):
+            folders.append(path)
+    return folders
+
+
+def select_frames(folders, every=1, interval=None):
+    """Yields the paths of every `every`th readable image in the folders,
+    or with interval (seconds) the first image at least that long after
+    the last one kept, along with its FrameManifest entry.
+
+    Each folder's manifest is brought up to date as it is reached.
+
+    """
+    count = 0
+    last_kept = None
+    for folder in folders:
+        manifest = FrameManifest(folder)
+        if manifest.update():
+            manifest.save()
+        for name in manifest.valid_frames():
+            if interval:
+                timestamp = manifest.timestamp(name)
+                if timestamp is None or (
+                    last_kept
+                    and (timestamp - last_kept).total_seconds() < interval
+                ):
+                    continue
+                last_kept = timestamp
+            else:
+                count += 1
+                if (count - 1) % every:
+                    continue
+            yield os.path.join(folder, name), manifest.frames[name]
+
+
+def fit_frame(img, size):
+    """Resizes img to size (width, height) unless it already has it."""
+    width, height = size
+    if img.shape[:2] != (height, width):
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img
+
+
+def create_range_timelapse(
+    images_folder,
+    output_path,
+    start=None,
+    end=None,
+    fps=30,
+    every=1,
+    interval=None,
+    reduce=1,
+    size=None,
+    workers=None,
+    prefetch=None,
+    encoder="auto",
+    preset="medium",
+    crf=23,
+    threads=0,
+):
+    """Encodes the images of the date folders from start to end into one
+    video, streaming them so memory use doesn't grow with the range.
+
+    images_folder: The folder of YYYY-MM-DD folders made by captureimg.py.
+    every: Keep every Nth frame.
+    interval: Keep one frame per this many seconds instead.
+    reduce: Decode JPEGs at 1/2, 1/4 or 1/8 of their size (1, 2, 4 or 8).
+    size: Video (width, height), defaults to the first frame's decoded
+        size. Frames of any other size are resized to it.
+    encoder: As for create_timelapse().
+
+    Returns the number of frames written.
+
+    """
+    flags = REDUCED_READ_FLAGS[reduce]
+    frames = select_frames(
+        date_folders(images_folder, start, end), every, interval
+    )
+    first = next(frames, None)
+    if first is None:
+        print("No images found.")
+        return 0
+    if size is None:
+        # Reduced decoding rounds the size up
+        size = (
+            -(-first[1]["width"] // reduce),
+            -(-first[1]["height"] // reduce),
+        )
+
+    paths = (path for path, _ in itertools.chain([first], frames))
+    out = open_video_writer(
+        output_path, fps, size, encoder, preset, crf, threads
+    )
+    read = functools.partial(cv2.imread, flags=flags)
+    written = skipped = 0
+    for img in read_frames(paths, workers, prefetch, read):
+        if img is None:
+            skipped += 1
+            continue
+        out.write(fit_frame(img, size))
+        written += 1
+        if written % 1000 == 0:
+            print(f"{written} frames written")
+    out.release()
+    print(
+        f"Timelapse creation complete! {written} frames, "
+        f"{skipped} unreadable"
+    )
+    return written
+
+
+# Options that only apply to a date range video
+RANGE_OPTIONS = (
+    "start",
+    "end",
+    "output",
+    "every",
+    "interval",
+    "reduce",
+    "size",
+)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Make a timelapse video of captured images. Without "
+        "--images, asks for one date folder."
+    )
+    parser.add_argument(
+        "--images",
+        help="Folder of YYYY-MM-DD image folders, for a video of a date range",
+    )
+    parser.add_argument("--fps", type=int, default=30)
+    date_range = parser.add_argument_group(
+        "date range options", "These need --images."
+    )
+    date_range.add_argument("--start", help="First date, YYYY-MM-DD")
+    date_range.add_argument("--end", help="Last date, YYYY-MM-DD")
+    date_range.add_argument(
+        "--output", help="Video file, timelapse.mp4 or .avi by default"
+    )
+    date_range.add_argument(
+        "--every", type=int, default=1, help="Keep every Nth frame"
+    )
+    date_range.add_argument(
+        "--interval", type=float, help="Keep one frame per this many seconds"
+    )
+    date_range.add_argument(
+        "--reduce",
+        type=int,
+        default=1,
+        choices=sorted(REDUCED_READ_FLAGS),
+        help="Decode at 1/N resolution",
+    )
+    date_range.add_argument(
+        "--size",
+        type=lambda text: tuple(int(n) for n in text.split("x")),
+        help="Video size as WIDTHxHEIGHT",
+    )
+    parser.add_argument(
+        "--encoder",
+        default="auto",
+        choices=["auto"] + list(ENCODERS),
+        help="x264 and x265 need ffmpeg, auto picks x264 if it's installed",
+    )
+    parser.add_argument("--preset", default="medium")
+    parser.add_argument("--crf", type=int, default=23)
+    parser.add_argument(
+        "--threads", type=int, default=0, help="Encoder threads, 0 for all"
+    )
+    return parser
+
+
 if __name__ == "__main__":
+    parser = build_parser()
+    args = parser.parse_args()
+    if not args.images:
+        for name in RANGE_OPTIONS:
+            if getattr(args, name) != parser.get_default(name):
+                parser.error(f"--{name} needs --images")
+    if args.images:
+        extension = ENCODERS[resolve_encoder(args.encoder)][0]
+        create_range_timelapse(
+            args.images,
+            args.output or f"timelapse{extension}",
+            args.start,
+            args.end,
+            fps=args.fps,
+            every=args.every,
+            interval=args.interval,
+            reduce=args.reduce,
+            size=args.size,
+            encoder=args.encoder,
+            preset=args.preset,
+            crf=args.crf,
+            threads=args.threads,
+        )
+        exit()
+
     root = tk.Tk()
     root.withdraw()
 
@@ -115,4 +688,12 @@ if __name__ == "__main__":
         )
         output_folder = "."
 
-    create_timelapse(input_folder, output_folder)
+    create_timelapse(
+        input_folder,
+        output_folder,
+        fps=args.fps,
+        encoder=args.encoder,
+        preset=args.preset,
+        crf=args.crf,
+        threads=args.threads,
+    )
@@ -0,0 +1,555 @@
+import abc
+import argparse
+import atexit
+import csv
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+
+
+class RotatingWriter(abc.ABC):
+    """Base class for the buffered log writers shared by the instruments.
+
+    The file is kept open between samples, rows are batched in memory and
+    flushed once `flush_rows` rows are pending or `flush_interval` seconds
+    have passed since the last flush. A new file is started whenever the
+    date changes.
+
+    """
+
+    def __init__(
+        self,
+        path_format,
+        header,
+        flush_rows=60,
+        flush_interval=10.0,
+        fsync=False,
+    ):
+        """path_format: strftime pattern for the file path, formatted with
+            the time the file is opened (e.g. "ion_data/ion_%Y%m%d.csv").
+        header: Column names of the rows passed to writerow.
+        flush_rows: Number of buffered rows that triggers a flush.
+        flush_interval: Maximum seconds rows may sit in the buffer.
+        fsync: Also fsync the file after every flush.
+
+        """
+        self.path_format = path_format
+        self.header = header
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        self.filename = None
+        self._is_open = False
+        self._date = None
+        self._rows = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def filename_for(self, now):
+        """Returns the file path used for a file opened at `now`."""
+        return now.strftime(self.path_format)
+
+    def writerow(self, row, now=None):
+        """Queues a row, opening or rotating the file as needed."""
+        if now is None:
+            now = datetime.now()
+        with self._lock:
+            if not self._is_open or now.date() != self._date:
+                self._rotate(now)
+            self._rows.append(self._record(row, now))
+            if (
+                len(self._rows) >= self.flush_rows
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self._flush()
+
+    def flush(self):
+        """Writes all buffered rows to disk."""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Flushes buffered rows and closes the current file."""
+        with self._lock:
+            self._close()
+
+    def _rotate(self, now):
+        self._close()
+        self.filename = self.filename_for(now)
+        folder = os.path.dirname(self.filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._open(self.filename)
+        self._is_open = True
+        self._date = now.date()
+
+    def _flush(self):
+        if self._is_open and self._rows:
+            self._write(self._rows)
+        self._rows = []
+        self._last_flush = time.monotonic()
+
+    def _close(self):
+        if self._is_open:
+            self._flush()
+            self._close_file()
+            self._is_open = False
+
+    def _record(self, row, now):
+        return row
+
+    @abc.abstractmethod
+    def _open(self, filename):
+        pass
+
+    @abc.abstractmethod
+    def _write(self, rows):
+        pass
+
+    @abc.abstractmethod
+    def _close_file(self):
+        pass
+
+
+class RotatingCSVWriter(RotatingWriter):
+    """Buffered, date-rotating CSV writer."""
+
+    def __init__(self, path_format, header, delimiter=",", **kwargs):
+        super().__init__(path_format, header, **kwargs)
+        self.delimiter = delimiter
+        self._file = None
+        self._writer = None
+
+    def _open(self, filename):
+        self._file = open(filename, "a", newline="")
+        self._writer = csv.writer(self._file, delimiter=self.delimiter)
+        if self._file.tell() == 0 and self.header:
+            self._rows.append(self.header)
+
+    def _write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _close_file(self):
+        self._file.close()
+        self._file = None
+        self._writer = None
+
+
+class ColumnarWriter(RotatingWriter):
+    """Buffered, date-rotating writer for a binary columnar store.
+
+    Each store is a directory holding one raw little-endian file per
+    column, an int64 `timestamp_ns` column (epoch nanoseconds) and a
+    `schema.json`. Columns are appended in place, so a store can be read
+    with `load_columns` (memory-mapped) while it is still being written.
+
+    """
+
+    SCHEMA = "schema.json"
+    TIMESTAMP = "timestamp_ns"
+
+    def __init__(
+        self, path_format, header, skip=(), converters=None, **kwargs
+    ):
+        """skip: Header names that are not stored (e.g. formatted times).
+        converters: Dict of header name to a callable returning a float.
+            Other columns are converted with float(), and values that
+            cannot be converted are stored as NaN.
+
+        """
+        super().__init__(path_format, header, **kwargs)
+        self.converters = converters or {}
+        self.columns = [
+            (i, name) for i, name in enumerate(header) if name not in skip
+        ]
+        self._files = None
+
+    def _record(self, row, now):
+        timestamp = int(now.timestamp()) * 10**9 + now.microsecond * 1000
+        values = []
+        for i, name in self.columns:
+            convert = self.converters.get(name, float)
+            try:
+                values.append(convert(row[i]))
+            except (TypeError, ValueError):
+                values.append(math.nan)
+        return timestamp, values
+
+    def _open(self, filename):
+        os.makedirs(filename, exist_ok=True)
+        schema = {
+            "timestamp": {"file": f"{self.TIMESTAMP}.i8", "dtype": "<i8"},
+            "columns": [
+                {"name": name, "file": f"c{n}.f8", "dtype": "<f8"}
+                for n, (_, name) in enumerate(self.columns)
+            ],
+        }
+        schema_path = os.path.join(filename, self.SCHEMA)
+        if os.path.exists(schema_path):
+            with open(schema_path, "r") as f:
+                if json.load(f) != schema:
+                    raise ValueError(f"{filename} has a different schema")
+        else:
+            with open(schema_path, "w") as f:
+                json.dump(schema, f, indent=2)
+        self._files = [
+            open(os.path.join(filename, entry["file"]), "ab")
+            for entry in [schema["timestamp"]] + schema["columns"]
+        ]
+
+    def _write(self, rows):
+        self._files[0].write(array("q", [r[0] for r in rows]).tobytes())
+        for n, f in enumerate(self._files[1:]):
+            f.write(array("d", [r[1][n] for r in rows]).tobytes())
+        for f in self._files:
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _close_file(self):
+        for f in self._files:
+            f.close()
+        self._files = None
+
+
+class RollupWriter:
+    """Passes rows on to a log writer and keeps count, mean, min, max and
+    std of each numeric column over fixed intervals (e.g. 1 min and 1 h).
+
+    Each resolution is written to its own file next to the raw one, with
+    the resolution added to the name ("..._1min.csv"), one row per
+    interval timestamped with the interval start. Intervals are aligned
+    to multiples of the resolution, and the unfinished ones are written
+    on close. Values that cannot be converted to float (and NaN) are left
+    out of the statistics.
+
+    """
+
+    STATS = ("count", "mean", "min", "max", "std")
+
+    def __init__(
+        self,
+        writer,
+        resolutions,
+        backend="csv",
+        skip=(),
+        converters=None,
+        angles=(),
+        **kwargs,
+    ):
+        """writer: The raw log writer.
+        resolutions: Interval lengths in seconds.
+        skip: Header names left out of the rollups.
+        converters: Dict of header name to a callable returning a float.
+        angles: Header names holding directions in degrees, rolled up as
+            a vector mean and circular std (min and max are NaN).
+        kwargs: Passed to the rollup writers.
+
+        """
+        self.writer = writer
+        self.converters = converters or {}
+        self.angles = set(angles)
+        self.columns = [
+            (i, name)
+            for i, name in enumerate(writer.header)
+            if name not in skip
+        ]
+        header = ["Timestamp"] + [
+            f"{name} {stat}" for _, name in self.columns for stat in self.STATS
+        ]
+        root, ext = os.path.splitext(writer.path_format)
+        kwargs["flush_rows"] = 1  # rollup rows are rare, write them as made
+        self._lock = threading.Lock()
+        self._rollups = []
+        for seconds in resolutions:
+            rollup_writer = open_writer(
+                f"{root}_{resolution_name(seconds)}{ext}",
+                header,
+                backend=backend,
+                skip=["Timestamp"],
+                **kwargs,
+            )
+            self._rollups.append([seconds, rollup_writer, None, None])
+        atexit.register(self.close)
+
+    def __getattr__(self, name):
+        if name == "writer":
+            raise AttributeError(name)
+        return getattr(self.writer, name)
+
+    def writerow(self, row, now=None):
+        if now is None:
+            now = datetime.now()
+        self.writer.writerow(row, now)
+
+        values = []
+        for i, name in self.columns:
+            try:
+                value = self.converters.get(name, float)(row[i])
+            except (TypeError, ValueError, IndexError):
+                value = math.nan
+            values.append(value)
+
+        timestamp = now.timestamp()
+        with self._lock:
+            for rollup in self._rollups:
+                seconds, rollup_writer, start, stats = rollup
+                bucket = math.floor(timestamp / seconds) * seconds
+                if bucket != start:
+                    if start is not None:
+                        self._write(rollup_writer, start, stats)
+                    rollup[2] = bucket
+                    rollup[3] = stats = [None] * len(values)
+                self._add(stats, values)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        """Writes the unfinished intervals and closes all files."""
+        with self._lock:
+            for rollup in self._rollups:
+                seconds, rollup_writer, start, stats = rollup
+                if start is not None:
+                    self._write(rollup_writer, start, stats)
+                    rollup[2] = rollup[3] = None
+                rollup_writer.close()
+        self.writer.close()
+
+    def _add(self, stats, values):
+        for n, value in enumerate(values):
+            if math.isnan(value):
+                continue
+            if self.columns[n][1] in self.angles:
+                radians = math.radians(value)
+                value = (math.sin(radians), math.cos(radians))
+                if stats[n] is None:
+                    stats[n] = [0, 0.0, 0.0]
+                stats[n][0] += 1
+                stats[n][1] += value[0]
+                stats[n][2] += value[1]
+                continue
+            if stats[n] is None:
+                # [count, shift, sum, sum of squares, min, max], summed
+                # relative to the first value to keep the std accurate
+                stats[n] = [0, value, 0.0, 0.0, value, value]
+            entry = stats[n]
+            entry[0] += 1
+            entry[2] += value - entry[1]
+            entry[3] += (value - entry[1]) ** 2
+            entry[4] = min(entry[4], value)
+            entry[5] = max(entry[5], value)
+
+    def _write(self, rollup_writer, start, stats):
+        nan = math.nan
+        row = [datetime.fromtimestamp(start).isoformat(sep=" ")]
+        for (_, name), entry in zip(self.columns, stats):
+            if entry is None:
+                row += [0, nan, nan, nan, nan]
+            elif name in self.angles:
+                count, sin_sum, cos_sum = entry
+                length = min(math.hypot(sin_sum, cos_sum) / count, 1.0)
+                mean = math.degrees(math.atan2(sin_sum, cos_sum)) % 360
+                if mean == 360:
+                    mean = 0.0
+                std = (
+                    math.degrees(math.sqrt(-2 * math.log(length)))
+                    if length > 0
+                    else nan
+                )
+                row += [count, mean, nan, nan, std]
+            else:
+                count, shift, total, squares, low, high = entry
+                mean = total / count
+                variance = max(squares / count - mean * mean, 0.0)
+                row += [count, shift + mean, low, high, math.sqrt(variance)]
+        rollup_writer.writerow(row, datetime.fromtimestamp(start))
+
+
+def resolution_name(seconds):
+    """File name suffix for a rollup resolution, e.g. 60 -> "1min"."""
+    for unit, length in (("d", 86400), ("h", 3600), ("min", 60)):
+        if seconds % length == 0:
+            return f"{seconds // length}{unit}"
+    return f"{seconds}s"
+
+
+def open_writer(
+    path_format,
+    header,
+    backend="csv",
+    skip=(),
+    converters=None,
+    rollups=None,
+    angles=(),
+    rollup_skip=(),
+    **kwargs,
+):
+    """Creates the log writer for the selected backend.
+
+    backend: "csv" or "columnar". For the columnar backend the extension
+        of `path_format` is replaced by ".cols" and `skip`/`converters`
+        are passed on to ColumnarWriter.
+    rollups: Optional interval lengths in seconds, the writer then also
+        keeps a RollupWriter file per interval. `angles` is passed on to
+        it.
+    rollup_skip: Header names left out of the rollups only, on top of
+        `skip` (e.g. status codes, which have no meaningful mean).
+
+    """
+    if backend == "csv":
+        writer = RotatingCSVWriter(path_format, header, **kwargs)
+    elif backend == "columnar":
+        path_format = os.path.splitext(path_format)[0] + ".cols"
+        writer = ColumnarWriter(
+            path_format, header, skip=skip, converters=converters, **kwargs
+        )
+    else:
+        raise ValueError(f"Unknown log backend: {backend}")
+    if rollups:
+        return RollupWriter(
+            writer,
+            rollups,
+            backend=backend,
+            skip=list(skip) + list(rollup_skip),
+            converters=converters,
+            angles=angles,
+            **kwargs,
+        )
+    return writer
+
+
+def load_columns(path, mmap=True):
+    """Loads a columnar store into a dict of NumPy arrays.
+
+    path: A ".cols" directory, or a ".npz"/".parquet" file made by compact.
+    mmap: Memory-map the column files of a ".cols" directory instead of
+        reading them into memory.
+
+    """
+    import numpy as np
+
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, memory_map=True)
+        return {name: table[name].to_numpy() for name in table.column_names}
+
+    with open(os.path.join(path, ColumnarWriter.SCHEMA), "r") as f:
+        schema = json.load(f)
+    entries = [dict(schema["timestamp"], name=ColumnarWriter.TIMESTAMP)]
+    entries += schema["columns"]
+
+    columns = {}
+    for entry in entries:
+        file_path = os.path.join(path, entry["file"])
+        dtype = np.dtype(entry["dtype"])
+        if mmap and os.path.getsize(file_path) >= dtype.itemsize:
+            columns[entry["name"]] = np.memmap(
+                file_path, dtype=dtype, mode="r"
+            )
+        else:
+            columns[entry["name"]] = np.fromfile(file_path, dtype=dtype)
+
+    # Columns can differ by a partial flush if the logger was killed
+    length = min(len(c) for c in columns.values())
+    return {name: c[:length] for name, c in columns.items()}
+
+
+def last_value(path, name):
+    """Returns the last stored value of a column, or None if there is none.
+
+    Only the final record of the column file is read.
+
+    """
+    schema_path = os.path.join(path, ColumnarWriter.SCHEMA)
+    if not os.path.exists(schema_path):
+        return None
+    with open(schema_path, "r") as f:
+        schema = json.load(f)
+    for entry in schema["columns"]:
+        if entry["name"] == name:
+            break
+    else:
+        return None
+
+    values = array("d")
+    with open(os.path.join(path, entry["file"]), "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        end -= end % values.itemsize
+        if end == 0:
+            return None
+        f.seek(end - values.itemsize)
+        values.frombytes(f.read(values.itemsize))
+    return values[0]
+
+
+def compact(path, fmt="npz"):
+    """Writes a compressed copy of a finished ".cols" store.
+
+    fmt: "npz" (NumPy only) or "parquet" (needs pyarrow, zstd compressed).
+
+    """
+    columns = load_columns(path, mmap=True)
+    out_path = os.path.splitext(path.rstrip("/\\"))[0] + "." + fmt
+    if fmt == "npz":
+        import numpy as np
+
+        np.savez_compressed(out_path, **columns)
+    elif fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.table(columns), out_path, compression="zstd")
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+    return out_path
+
+
+def export_csv(path, csv_path):
+    """Exports a columnar store to CSV with an ISO timestamp column."""
+    columns = load_columns(path, mmap=True)
+    names = [n for n in columns if n != ColumnarWriter.TIMESTAMP]
+    timestamps = columns[ColumnarWriter.TIMESTAMP]
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Timestamp"] + names)
+        for i in range(len(timestamps)):
+            stamp = datetime.fromtimestamp(int(timestamps[i]) / 1e9)
+            writer.writerow(
+                [stamp.isoformat()]
+                + [repr(float(columns[n][i])) for n in names]
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar log store tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export to CSV")
+    export_parser.add_argument("store")
+    export_parser.add_argument("csv_path")
+
+    compact_parser = subparsers.add_parser("compact", help="Compress a store")
+    compact_parser.add_argument("store")
+    compact_parser.add_argument(
+        "--format", choices=["npz", "parquet"], default="npz"
+    )
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_csv(args.store, args.csv_path)
+    else:
+        print(compact(args.store, args.format))
@@ -0,0 +1,343 @@
+import abc
+import functools
+import queue
+import threading
+from concurrent.futures import Future
+
+# Largest U3 command/response packet, see getFeedback() in u3.py
+MAX_USB_PACKET_LENGTH = 64
+
+
+class DeviceBroker(abc.ABC):
+    """Owns one device handle and runs every request on a single thread.
+
+    Instruments submit requests from their own threads and block until the
+    broker thread has served them, so transfers on the handle never
+    interleave. Each time the broker wakes it takes everything queued so
+    far, and consecutive batchable requests (feedback reads on a U3,
+    eReadNames on a T7) from different instruments go out as one device
+    call.
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._requests = queue.Queue()
+        self._thread = None
+        self.requests = 0  # requests served
+        self.transactions = 0  # device calls made for them
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name=f"{self.name} broker", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Serves the requests already queued, then stops the thread."""
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def call(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) on the broker thread and returns its
+        result, or raises its exception.
+
+        """
+        if threading.current_thread() is self._thread:
+            return func(*args, **kwargs)
+        return self._submit("call", (func, args, kwargs))
+
+    def report(self):
+        return (
+            f"{self.name}: {self.requests} requests in "
+            f"{self.transactions} transactions"
+        )
+
+    def _submit(self, kind, payload):
+        future = Future()
+        self._requests.put((kind, payload, future))
+        return future.result()
+
+    @abc.abstractmethod
+    def _batch(self, payloads):
+        """Sends several batchable requests as one device call and returns
+        one result per payload.
+
+        """
+
+    def _fits(self, payloads):
+        """Whether the payloads can go out together in one device call."""
+        return True
+
+    def _retryable(self, payload):
+        """Whether payload can be sent again after a merged call failed,
+        i.e. it only reads, so running it twice has no effect.
+
+        """
+        return False
+
+    def _run(self):
+        while True:
+            requests = [self._requests.get()]
+            while True:
+                try:
+                    requests.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = None in requests
+            requests = [request for request in requests if request is not None]
+
+            i = 0
+            while i < len(requests):
+                j = i + 1
+                if requests[i][0] == "batch":
+                    while j < len(requests) and requests[j][0] == "batch":
+                        j += 1
+                    self._serve_batch(requests[i:j])
+                else:
+                    _, (func, args, kwargs), future = requests[i]
+                    self._serve(future, func, *args, **kwargs)
+                i = j
+
+            if stopping:
+                return
+
+    def _serve(self, future, func, *args, **kwargs):
+        self.requests += 1
+        self.transactions += 1
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _serve_batch(self, requests):
+        # Split into the largest runs that fit in one device call
+        chunks = [[requests[0]]]
+        for request in requests[1:]:
+            payloads = [payload for _, payload, _ in chunks[-1]]
+            if self._fits(payloads + [request[1]]):
+                chunks[-1].append(request)
+            else:
+                chunks.append([request])
+
+        for chunk in chunks:
+            if len(chunk) == 1:
+                _, payload, future = chunk[0]
+                self._serve(future, lambda: self._batch([payload])[0])
+                continue
+            try:
+                results = self._batch([payload for _, payload, _ in chunk])
+            except Exception as e:
+                # Part of the call may have run, so only read-only requests
+                # are retried, one by one so the error reaches the request
+                # that caused it
+                for _, payload, future in chunk:
+                    if self._retryable(payload):
+                        self._serve(
+                            future,
+                            lambda payload=payload: self._batch([payload])[0],
+                        )
+                    else:
+                        self.requests += 1
+                        if future.set_running_or_notify_cancel():
+                            future.set_exception(e)
+                self.transactions += 1
+                continue
+            self.requests += len(chunk)
+            self.transactions += 1
+            for (_, _, future), result in zip(chunk, results):
+                if future.set_running_or_notify_cancel():
+                    future.set_result(result)
+
+
+def _flatten(commands):
+    flat = []
+    for command in commands:
+        if isinstance(command, (list, tuple)):
+            flat.extend(_flatten(command))
+        else:
+            flat.append(command)
+    return flat
+
+
+class U3Broker(DeviceBroker):
+    """Broker for a u3.U3. Feedback commands from different instruments
+    are packed into shared getFeedback packets.
+
+    """
+
+    def __init__(self, device, name="U3"):
+        """device: The object to an opened U3."""
+        super().__init__(name)
+        self.device = device
+
+    def feedback(self, commands):
+        """Runs a list of feedback commands, returns their results."""
+        return self._submit("batch", _flatten(commands))
+
+    def proxy(self):
+        return U3Proxy(self)
+
+    def _batch(self, payloads):
+        commands = [command for payload in payloads for command in payload]
+        results = self.device.getFeedback(*commands)
+        split = []
+        for payload in payloads:
+            split.append(results[: len(payload)])
+            results = results[len(payload) :]
+        return split
+
+    def _retryable(self, payload):
+        import u3
+
+        # Other commands may write, or reset a timer or counter
+        return all(isinstance(command, u3.AIN) for command in payload)
+
+    def _fits(self, payloads):
+        commands = [command for payload in payloads for command in payload]
+        try:
+            send_length = 7 + sum(
+                len(command.cmdBytes) for command in commands
+            )
+            read_length = 9 + sum(command.readLen for command in commands)
+        except AttributeError:
+            return len(payloads) == 1
+        return (
+            send_length + send_length % 2 <= MAX_USB_PACKET_LENGTH
+            and read_length + read_length % 2 <= MAX_USB_PACKET_LENGTH
+        )
+
+
+class U3Proxy:
+    """Stands in for a u3.U3 in instrument code.
+
+    getFeedback and getAIN go through the broker's batched feedback path,
+    other methods run serialized on the broker thread, and attributes like
+    serialNumber and calData are read straight from the device.
+
+    """
+
+    # Pure conversions that don't talk to the device
+    LOCAL_METHODS = {"binaryToCalibratedAnalogVoltage"}
+    # Stream data is read outside the broker, and stops the AIN reads of
+    # the instruments sharing the device
+    STREAM_METHODS = {"streamConfig", "streamStart", "streamData"}
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._device = broker.device
+
+    def getFeedback(self, *commandlist):
+        return self._broker.feedback(commandlist)
+
+    def getAIN(
+        self, posChannel, negChannel=31, longSettle=False, quickSample=False
+    ):
+        """Same as U3.getAIN(), with the read sent through the broker."""
+        import u3
+
+        isSpecial = negChannel == 32
+        if isSpecial:
+            negChannel = 30
+        bits = self.getFeedback(
+            u3.AIN(posChannel, negChannel, longSettle, quickSample)
+        )[0]
+        lvChannel = not (
+            getattr(self._device, "isHV", False) and posChannel < 4
+        )
+        return self._device.binaryToCalibratedAnalogVoltage(
+            bits,
+            isLowVoltage=lvChannel,
+            isSingleEnded=negChannel == 31,
+            isSpecialSetting=isSpecial,
+            channelNumber=posChannel,
+        )
+
+    def close(self):
+        """The broker owns the handle, so instruments can't close it."""
+
+    def __getattr__(self, name):
+        if name in self.STREAM_METHODS:
+            raise RuntimeError(f"{name} isn't allowed on a brokered U3")
+        attr = getattr(self._device, name)
+        if not callable(attr) or name in self.LOCAL_METHODS:
+            return attr
+        return functools.partial(self._broker.call, attr)
+
+
+class T7Broker(DeviceBroker):
+    """Broker for a T7 opened with LJM. eReadNames calls from different
+    instruments are merged into one.
+
+    """
+
+    def __init__(self, handle, name="T7"):
+        """handle: A handle from ljm.openS()."""
+        super().__init__(name)
+        self.handle = handle
+
+    def read_names(self, names):
+        return self._submit("batch", list(names))
+
+    def _retryable(self, payload):
+        return True  # eReadNames only reads
+
+    def proxy(self):
+        return LJMProxy(self)
+
+    def _batch(self, payloads):
+        from labjack import ljm
+
+        names = [name for payload in payloads for name in payload]
+        results = ljm.eReadNames(self.handle, len(names), names)
+        split = []
+        for payload in payloads:
+            split.append(list(results[: len(payload)]))
+            results = results[len(payload) :]
+        return split
+
+
+class LJMProxy:
+    """Stands in for the labjack.ljm module for instruments on a brokered
+    T7, so they keep calling e.g. ljm_api.eWriteName(handle, ...).
+
+    eReadNames is batched and other calls run serialized on the broker
+    thread. Stream calls bypass the broker, since eStreamRead blocks until
+    a scan block arrives and LJM already makes them safe to call from
+    another thread.
+
+    """
+
+    UNBROKERED = {
+        "eStreamStart",
+        "eStreamRead",
+        "eStreamStop",
+        "namesToAddresses",
+        "nameToAddress",
+    }
+
+    def __init__(self, broker):
+        self._broker = broker
+
+    def eReadNames(self, handle, numFrames, aNames):
+        return self._broker.read_names(aNames[:numFrames])
+
+    def close(self, handle):
+        """The broker owns the handle, so instruments can't close it."""
+
+    def __getattr__(self, name):
+        from labjack import ljm
+
+        attr = getattr(ljm, name)
+        if (
+            not callable(attr)
+            or isinstance(attr, type)
+            or name in self.UNBROKERED
+        ):
+            return attr
+        return functools.partial(self._broker.call, attr)
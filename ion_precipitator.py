@@ -1,170 +1,268 @@
-import tkinter as tk
-from tkinter import ttk, font
 from threading import Thread
 import time
-import csv
-import os
 from datetime import datetime
 import u3
 import ljtickdac
-
-# Initialize LabJack U3
-d = u3.U3()
-d.getCalibrationData()
-d.configIO(FIOAnalog=0x0F)
-dioPin = 4
-tdac = ljtickdac.LJTickDAC(d, dioPin)
+import datalogger
+import telemetry
 
 # Initialize parameters
 scaling_factor = 500
-toggle_time = 30.0
-state = "OFF"
-running = False
-
-
-# Function to get new CSV filename
-def get_csv_filename():
-    """Generate a new CSV filename based on the current date and time."""
-    return f"ion_data/ion_precipitator_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-
-
-# Create an "ion_data" folder if it doesn't exist
-if not os.path.exists("ion_data"):
-    os.makedirs("ion_data")
-
-csv_filename = get_csv_filename()
-
-
-def voltage_loop():
-    """Main loop for toggling voltage and updating GUI."""
-    global state, running, toggle_time, csv_filename
-    toggle_timer = 0.0
-
-    while running:
-        start_time = time.time()
-        set_voltage = float(entry_set_voltage.get())
-        toggle_time = float(entry_toggle_time.get())
-        dacA_on = set_voltage / scaling_factor
-        toggle_timer += 1.0
-
-        # Toggle voltage
-        if toggle_timer >= toggle_time:
-            if state == "ON":
-                state = "OFF"
-                tdac.update(0.0, 0.0)
-            else:
-                state = "ON"
-                tdac.update(dacA_on, 0.0)
-            toggle_timer = 0
-
-        # Update GUI
-        volt = d.getAIN(0) * scaling_factor
-        current_time = datetime.now().strftime("%H:%M:%S")
-        time_label.config(text=f"Current Time: {current_time}")
-        status_label.config(text=f"Voltage Status: {state}")
-        monitor_label.config(text=f"Voltage Monitor: {volt} V")
-
-        # Log to CSV
-        with open(csv_filename, "a", newline="") as csv_file:
-            csv_writer = csv.writer(csv_file)
-            if csv_file.tell() == 0:
-                csv_writer.writerow(
-                    [
-                        "Timestamp",
-                        "State",
-                        "Set Voltage (V)",
-                        "AIN0 Voltage (V)",
-                    ]
-                )
-            csv_writer.writerow(
-                [current_time, state, set_voltage if state == "ON" else 0, volt]
+log_backend = "csv"  # "csv" or "columnar"
+rollups = (60, 3600)  # seconds per row of the averaged files
+
+
+class IonPrecipitator:
+    """Toggles the ion precipitator voltage and logs the monitor voltage."""
+
+    def __init__(
+        self, device=None, set_voltage=1000.0, toggle_time=30.0, dio_pin=4
+    ):
+        """device: The object to an opened U3, one is opened if None.
+        set_voltage: Voltage (V) applied in the ON state.
+        toggle_time: Seconds between switching ON and OFF.
+        dio_pin: The DIO line the LJTick-DAC's DIOA is connected to.
+
+        """
+        # Initialize LabJack U3
+        if device is None:
+            device = u3.U3()
+        self.d = device
+        self.d.getCalibrationData()
+        self.d.configIO(FIOAnalog=0x0F)
+        self.tdac = ljtickdac.LJTickDAC(
+            self.d, dio_pin, cachePath="ljtickdac_cal.json"
+        )
+
+        self.set_voltage = set_voltage
+        self.toggle_time = toggle_time
+        self.state = "OFF"
+        self.running = False
+        self.thread = None
+
+        # CSV writer, a new file is started in "ion_data" at each date change
+        self.csv_writer = datalogger.open_writer(
+            "ion_data/ion_precipitator_%Y%m%d_%H%M%S.csv",
+            ["Timestamp", "State", "Set Voltage (V)", "AIN0 Voltage (V)"],
+            backend=log_backend,
+            skip=["Timestamp"],
+            converters={"State": lambda state: float(state == "ON")},
+            flush_rows=60,
+            flush_interval=10.0,
+            rollups=rollups,
+        )
+
+        # Samples go to the GUI on "telemetry_bus", entry changes come back
+        # on "controls"
+        self.telemetry_bus = telemetry.TelemetryBus()
+        self.controls = telemetry.TelemetryBus()
+
+    def voltage_loop(self):
+        """Main loop for toggling voltage and updating GUI."""
+        toggle_timer = 0.0
+
+        while self.running:
+            start_time = time.time()
+            new_controls = self.controls.drain()
+            self.set_voltage = new_controls.get(
+                "set_voltage", self.set_voltage
+            )
+            self.toggle_time = new_controls.get(
+                "toggle_time", self.toggle_time
+            )
+            dacA_on = self.set_voltage / scaling_factor
+            toggle_timer += 1.0
+
+            # Toggle voltage
+            if toggle_timer >= self.toggle_time:
+                if self.state == "ON":
+                    self.state = "OFF"
+                    self.tdac.update(0.0, 0.0)
+                else:
+                    self.state = "ON"
+                    self.tdac.update(dacA_on, 0.0)
+                toggle_timer = 0
+
+            # Update GUI
+            volt = self.d.getAIN(0) * scaling_factor
+            now = datetime.now()
+            current_time = now.strftime("%H:%M:%S")
+            self.telemetry_bus.publish("time", current_time)
+            self.telemetry_bus.publish("state", self.state)
+            self.telemetry_bus.publish("monitor", volt)
+
+            # Log to CSV
+            set_voltage = self.set_voltage if self.state == "ON" else 0
+            self.csv_writer.writerow(
+                [current_time, self.state, set_voltage, volt], now
             )
 
-        # Sleep
-        elapsed_time = time.time() - start_time
-        time.sleep(max(0, 1.0 - elapsed_time))
-
-        # Check if it's a new day and create a new CSV file
-        if datetime.now().strftime("%H:%M:%S") == "00:00:00":
-            csv_filename = get_csv_filename()
-
-
-def start_stop():
-    """Start or stop the voltage toggling loop."""
-    global running
-    if btn_start["text"] == "Start":
-        running = True
-        btn_start.config(text="Stop")
-        thread = Thread(target=voltage_loop)
-        thread.daemon = True
-        thread.start()
-    else:
-        running = False
-        btn_start.config(text="Start")
-
-
-def close_app():
-    """Close the application."""
-    global running
-    running = False
-    d.close()
-    root.quit()
-    root.destroy()
-
-
-# Initialize Tkinter GUI
-root = tk.Tk()
-root.title("Voltage Controller")
-root.geometry("400x250")
-root.configure(bg="light gray")
-
-# Create a style
-style = ttk.Style(root)
-style.configure("TButton", font=("Helvetica", 12))
-style.configure("TLabel", font=("Helvetica", 12))
-
-app_font = font.nametofont("TkDefaultFont")
-app_font.config(size=12)
-
-# Center widgets by adjusting row and column weights
-for i in range(2):
-    root.grid_columnconfigure(i, weight=1)
-for i in range(6):
-    root.grid_rowconfigure(i, weight=1)
-
-# Entry for Set Voltage
-lbl_set_voltage = ttk.Label(root, text="Set Voltage (V):", font=app_font)
-lbl_set_voltage.grid(column=0, row=0, sticky="nsew", padx=10, pady=5)
-entry_set_voltage = ttk.Entry(root, font=app_font)
-entry_set_voltage.grid(column=1, row=0, sticky="nsew", padx=10, pady=5)
-entry_set_voltage.insert(0, "1000")
-
-# Entry for Voltage Interval
-lbl_toggle_time = ttk.Label(root, text="Voltage Interval (s):", font=app_font)
-lbl_toggle_time.grid(column=0, row=1, sticky="nsew", padx=10, pady=5)
-entry_toggle_time = ttk.Entry(root, font=app_font)
-entry_toggle_time.grid(column=1, row=1, sticky="nsew", padx=10, pady=5)
-entry_toggle_time.insert(0, "30")
-
-# Display fields
-time_label = ttk.Label(root, text="Current Time: ", font=app_font)
-time_label.grid(column=0, row=2, columnspan=2, sticky="nsew", padx=10, pady=5)
-
-status_label = ttk.Label(root, text="Voltage Status: ", font=app_font)
-status_label.grid(column=0, row=3, columnspan=2, sticky="nsew", padx=10, pady=5)
-
-monitor_label = ttk.Label(root, text="Voltage Monitor: ", font=app_font)
-monitor_label.grid(
-    column=0, row=4, columnspan=2, sticky="nsew", padx=10, pady=5
-)
-
-# Start/Stop Button
-btn_start = ttk.Button(root, text="Start", command=start_stop, style="TButton")
-btn_start.grid(column=0, row=5, sticky="nsew", padx=10, pady=10)
-
-# Close Button
-btn_close = ttk.Button(root, text="Close", command=close_app, style="TButton")
-btn_close.grid(column=1, row=5, sticky="nsew", padx=10, pady=10)
-
-
-root.mainloop()
+            # Sleep
+            elapsed_time = time.time() - start_time
+            time.sleep(max(0, 1.0 - elapsed_time))
+
+        self.csv_writer.flush()
+
+    def start(self):
+        """Start the voltage toggling loop on a separate thread."""
+        self.running = True
+        self.thread = Thread(target=self.voltage_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the voltage toggling loop."""
+        self.running = False
+
+    def close(self):
+        self.stop()
+        if self.thread is not None:
+            self.thread.join()
+        self.csv_writer.close()
+        self.d.close()
+
+
+def run_gui(ion):
+    """Show the voltage controller window until it is closed."""
+    import tkinter as tk
+    from tkinter import ttk, font
+
+    def start_stop():
+        """Start or stop the voltage toggling loop."""
+        if btn_start["text"] == "Start":
+            publish_controls()
+            ion.start()
+            btn_start.config(text="Stop")
+        else:
+            ion.stop()
+            btn_start.config(text="Start")
+
+    def publish_controls(*args):
+        """Send the entry values to the voltage loop, ignoring invalid ones."""
+        for name, var in (
+            ("set_voltage", set_voltage_var),
+            ("toggle_time", toggle_time_var),
+        ):
+            try:
+                ion.controls.publish(name, float(var.get()))
+            except ValueError:
+                pass
+
+    def close_app():
+        """Close the application."""
+        root.quit()
+        root.destroy()
+
+    # Initialize Tkinter GUI
+    root = tk.Tk()
+    root.title("Voltage Controller")
+    root.geometry("400x250")
+    root.configure(bg="light gray")
+
+    # Create a style
+    style = ttk.Style(root)
+    style.configure("TButton", font=("Helvetica", 12))
+    style.configure("TLabel", font=("Helvetica", 12))
+
+    app_font = font.nametofont("TkDefaultFont")
+    app_font.config(size=12)
+
+    # Center widgets by adjusting row and column weights
+    for i in range(2):
+        root.grid_columnconfigure(i, weight=1)
+    for i in range(6):
+        root.grid_rowconfigure(i, weight=1)
+
+    # Entry for Set Voltage
+    lbl_set_voltage = ttk.Label(root, text="Set Voltage (V):", font=app_font)
+    lbl_set_voltage.grid(column=0, row=0, sticky="nsew", padx=10, pady=5)
+    set_voltage_var = tk.StringVar(root, value=f"{ion.set_voltage:g}")
+    set_voltage_var.trace_add("write", publish_controls)
+    entry_set_voltage = ttk.Entry(
+        root, font=app_font, textvariable=set_voltage_var
+    )
+    entry_set_voltage.grid(column=1, row=0, sticky="nsew", padx=10, pady=5)
+
+    # Entry for Voltage Interval
+    lbl_toggle_time = ttk.Label(
+        root, text="Voltage Interval (s):", font=app_font
+    )
+    lbl_toggle_time.grid(column=0, row=1, sticky="nsew", padx=10, pady=5)
+    toggle_time_var = tk.StringVar(root, value=f"{ion.toggle_time:g}")
+    toggle_time_var.trace_add("write", publish_controls)
+    entry_toggle_time = ttk.Entry(
+        root, font=app_font, textvariable=toggle_time_var
+    )
+    entry_toggle_time.grid(column=1, row=1, sticky="nsew", padx=10, pady=5)
+
+    # Display fields
+    time_label = ttk.Label(root, text="Current Time: ", font=app_font)
+    time_label.grid(
+        column=0, row=2, columnspan=2, sticky="nsew", padx=10, pady=5
+    )
+
+    status_label = ttk.Label(root, text="Voltage Status: ", font=app_font)
+    status_label.grid(
+        column=0, row=3, columnspan=2, sticky="nsew", padx=10, pady=5
+    )
+
+    monitor_label = ttk.Label(root, text="Voltage Monitor: ", font=app_font)
+    monitor_label.grid(
+        column=0, row=4, columnspan=2, sticky="nsew", padx=10, pady=5
+    )
+
+    # Start/Stop Button
+    btn_start = ttk.Button(
+        root, text="Start", command=start_stop, style="TButton"
+    )
+    btn_start.grid(column=0, row=5, sticky="nsew", padx=10, pady=10)
+
+    # Close Button
+    btn_close = ttk.Button(
+        root, text="Close", command=close_app, style="TButton"
+    )
+    btn_close.grid(column=1, row=5, sticky="nsew", padx=10, pady=10)
+
+    # Update the labels with the newest samples five times a second
+    ion.telemetry_bus.subscribe(
+        "time", lambda t: time_label.config(text=f"Current Time: {t}")
+    )
+    ion.telemetry_bus.subscribe(
+        "state", lambda s: status_label.config(text=f"Voltage Status: {s}")
+    )
+    ion.telemetry_bus.subscribe(
+        "monitor",
+        lambda v: monitor_label.config(text=f"Voltage Monitor: {v} V"),
+    )
+    ion.telemetry_bus.attach(root, 200)
+
+    root.mainloop()
+
+
+def main(
+    headless=False,
+    set_voltage=1000.0,
+    toggle_time=30.0,
+    device=None,
+    dio_pin=4,
+):
+    """Run the ion precipitator. Headless mode starts toggling right away
+    and runs until interrupted.
+
+    """
+    ion = IonPrecipitator(device, set_voltage, toggle_time, dio_pin)
+    try:
+        if headless:
+            ion.start()
+            while True:
+                time.sleep(1)
+        else:
+            run_gui(ion)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ion.close()
+
+
+if __name__ == "__main__":
+    main()
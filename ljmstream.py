@@ -0,0 +1,129 @@
+import math
+import threading
+
+import numpy as np
+from labjack import ljm
+
+
+class LJMStreamStats:
+    """Streams channels from a LabJack T7 and keeps per-channel statistics.
+
+    A thread reads the hardware stream and accumulates count, sum, sum of
+    squares, min and max for each channel. collect() returns the
+    statistics since the last call and starts a new interval.
+
+    """
+
+    def __init__(
+        self, handle, names, scan_rate=100, scans_per_read=None, ljm_api=ljm
+    ):
+        """handle: An open LJM handle.
+        names: Register names to stream (e.g. ["AIN0", "AIN1"]).
+        scan_rate: Scans per second.
+        scans_per_read: Scans returned by each eStreamRead, defaults to a
+            tenth of a second of data.
+        ljm_api: The module the stream is run through, e.g. a
+            devicebroker.LJMProxy when the T7 is shared.
+
+        """
+        self.ljm = ljm_api
+        self.handle = handle
+        self.names = list(names)
+        self.scan_rate = scan_rate
+        self.scans_per_read = scans_per_read or max(1, int(scan_rate / 10))
+
+        self.skipped = 0
+        self.device_backlog = 0
+        self.running = False
+        self.error = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        n = len(self.names)
+        self._count = np.zeros(n)
+        self._sum = np.zeros(n)
+        self._sumsq = np.zeros(n)
+        self._min = np.full(n, np.inf)
+        self._max = np.full(n, -np.inf)
+
+    def start(self):
+        addresses = self.ljm.namesToAddresses(len(self.names), self.names)[0]
+        # Internally-clocked stream with no trigger
+        self.ljm.eWriteNames(
+            self.handle,
+            2,
+            ["STREAM_TRIGGER_INDEX", "STREAM_CLOCK_SOURCE"],
+            [0, 0],
+        )
+        self.scan_rate = self.ljm.eStreamStart(
+            self.handle,
+            self.scans_per_read,
+            len(addresses),
+            addresses,
+            self.scan_rate,
+        )
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.ljm.eStreamStop(self.handle)
+        except self.ljm.LJMError:
+            # A stream that failed may already be stopped
+            if self.error is None:
+                raise
+
+    def collect(self):
+        """Returns a dict of per-channel arrays (count, mean, std, min,
+        max) for the samples since the last call, NaN where there were
+        none.
+
+        """
+        with self._lock:
+            count, total, sumsq = self._count, self._sum, self._sumsq
+            low, high = self._min, self._max
+            self._reset()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            variance = np.maximum(sumsq / count - mean * mean, 0.0)
+        empty = count == 0
+        return {
+            "count": count,
+            "mean": mean,
+            "std": np.sqrt(variance),
+            "min": np.where(empty, np.nan, low),
+            "max": np.where(empty, np.nan, high),
+        }
+
+    def _run(self):
+        n = len(self.names)
+        while self.running:
+            try:
+                data, self.device_backlog, _ = self.ljm.eStreamRead(
+                    self.handle
+                )
+            except self.ljm.LJMError as e:
+                self.error = e
+                self.running = False
+                break
+            block = np.asarray(data).reshape(-1, n)
+            valid = block != self.ljm.constants.DUMMY_VALUE
+            self.skipped += int(np.count_nonzero(~valid))
+            values = np.where(valid, block, 0.0)
+            with self._lock:
+                self._count += valid.sum(axis=0)
+                self._sum += values.sum(axis=0)
+                self._sumsq += (values * values).sum(axis=0)
+                self._min = np.minimum(
+                    self._min, np.where(valid, block, math.inf).min(axis=0)
+                )
+                self._max = np.maximum(
+                    self._max, np.where(valid, block, -math.inf).max(axis=0)
+                )
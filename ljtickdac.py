@@ -1,4 +1,8 @@
+import json
+import os
 import struct
+import threading
+import zlib
 
 
 class LJTickDAC:
@@ -6,19 +10,52 @@ class LJTickDAC:
 
     EEPROM_ADDRESS = 0x50
     DAC_ADDRESS = 0x12
+    # Write to and update DAC command bytes
+    DACA_COMMAND = 48
+    DACB_COMMAND = 49
 
-    def __init__(self, device, dioPin):
+    def __init__(
+        self,
+        device,
+        dioPin,
+        batched=False,
+        cachePath=None,
+        refreshInBackground=False,
+    ):
         """device: The object to an opened U3, U6 or UE9.
         dioPin: The digital I/O line that the LJTick-DAC's DIOA is connected to.
+        batched: Send both channels of update() in one I2C transaction.
+            This relies on the DAC accepting back-to-back command words
+            without a stop, so check it on the hardware before enabling.
+        cachePath: JSON file caching the calibration constants by device
+            serial number and DIO pin. A valid cached entry is used instead
+            of reading the EEPROM at startup.
+        refreshInBackground: When the cached constants are used, re-read
+            the EEPROM on a thread and update the cache. Only enable this
+            if nothing else talks to the device during startup.
 
         """
         self.device = device
+        self.batched = batched
+        self.cachePath = cachePath
 
         # The pin numbers for the I2C command-response
         self.sclPin = dioPin
         self.sdaPin = self.sclPin + 1
 
-        self.getCalConstants()
+        # Last binary codes written, so unchanged values aren't resent
+        self.binaryA = None
+        self.binaryB = None
+
+        if self.loadCachedConstants():
+            if refreshInBackground:
+                threading.Thread(
+                    target=self.refreshCalConstants,
+                    kwargs={"raiseErrors": False},
+                    daemon=True,
+                ).start()
+        else:
+            self.refreshCalConstants()
 
     def toDouble(self, buff):
         """Converts the 8 byte array into a floating point number.
@@ -41,10 +78,6 @@ class LJTickDAC:
             SCLPinNum=self.sclPin,
         )
         response = data["I2CBytes"]
-        self.slopeA = self.toDouble(response[0:8])
-        self.offsetA = self.toDouble(response[8:16])
-        self.slopeB = self.toDouble(response[16:24])
-        self.offsetB = self.toDouble(response[24:32])
 
         if 255 in response:
             msg = (
@@ -53,23 +86,146 @@ class LJTickDAC:
             )
             raise Exception(msg)
 
-    def update(self, dacA, dacB):
-        """Updates the voltages on the LJTick-DAC.
-        dacA: The DACA voltage to set.
-        dacB: The DACB voltage to set.
+        self.slopeA = self.toDouble(response[0:8])
+        self.offsetA = self.toDouble(response[8:16])
+        self.slopeB = self.toDouble(response[16:24])
+        self.offsetB = self.toDouble(response[24:32])
+
+    def cacheKey(self):
+        serial = getattr(self.device, "serialNumber", None)
+        if serial is None:
+            return None
+        return f"{serial}:{self.sclPin}"
+
+    def constantsChecksum(self, constants):
+        return zlib.crc32(struct.pack("<4d", *constants))
+
+    def readCache(self):
+        if self.cachePath is None or not os.path.exists(self.cachePath):
+            return {}
+        try:
+            with open(self.cachePath, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def loadCachedConstants(self):
+        """Loads the calibration constants from the cache file.
+        Returns False if there is no valid entry for this device and pin.
 
         """
-        binaryA = int(dacA * self.slopeA + self.offsetA)
-        self.device.i2c(
-            LJTickDAC.DAC_ADDRESS,
-            [48, binaryA // 256, binaryA % 256],
-            SDAPinNum=self.sdaPin,
-            SCLPinNum=self.sclPin,
-        )
-        binaryB = int(dacB * self.slopeB + self.offsetB)
+        key = self.cacheKey()
+        if key is None:
+            return False
+        entry = self.readCache().get(key)
+        try:
+            constants = [float(c) for c in entry["constants"]]
+            valid = entry["checksum"] == self.constantsChecksum(constants)
+        except (TypeError, KeyError, ValueError, struct.error):
+            return False
+        if not valid:
+            return False
+        self.slopeA, self.offsetA, self.slopeB, self.offsetB = constants
+        return True
+
+    def saveCachedConstants(self):
+        """Saves the current calibration constants to the cache file."""
+        key = self.cacheKey()
+        if self.cachePath is None or key is None:
+            return
+        constants = [self.slopeA, self.offsetA, self.slopeB, self.offsetB]
+        cache = self.readCache()
+        cache[key] = {
+            "constants": constants,
+            "checksum": self.constantsChecksum(constants),
+        }
+        tmpPath = self.cachePath + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmpPath, self.cachePath)
+
+    def refreshCalConstants(self, raiseErrors=True):
+        """Reads the calibration constants from the EEPROM and updates the
+        cache. With raiseErrors=False a failed read keeps the current
+        constants.
+
+        """
+        try:
+            self.getCalConstants()
+        except Exception:
+            if raiseErrors:
+                raise
+            return
+        self.saveCachedConstants()
+
+    def toBinaryA(self, dacA):
+        return int(dacA * self.slopeA + self.offsetA)
+
+    def toBinaryB(self, dacB):
+        return int(dacB * self.slopeB + self.offsetB)
+
+    def writeDAC(self, data):
         self.device.i2c(
             LJTickDAC.DAC_ADDRESS,
-            [49, binaryB // 256, binaryB % 256],
+            data,
             SDAPinNum=self.sdaPin,
             SCLPinNum=self.sclPin,
         )
+
+    def updateA(self, dacA, force=False):
+        """Updates the DACA voltage, skipping the write if unchanged.
+        dacA: The DACA voltage to set.
+        force: Write even if the binary code hasn't changed.
+
+        """
+        binaryA = self.toBinaryA(dacA)
+        if force or binaryA != self.binaryA:
+            self.writeDAC(
+                [LJTickDAC.DACA_COMMAND, binaryA // 256, binaryA % 256]
+            )
+            self.binaryA = binaryA
+
+    def updateB(self, dacB, force=False):
+        """Updates the DACB voltage, skipping the write if unchanged.
+        dacB: The DACB voltage to set.
+        force: Write even if the binary code hasn't changed.
+
+        """
+        binaryB = self.toBinaryB(dacB)
+        if force or binaryB != self.binaryB:
+            self.writeDAC(
+                [LJTickDAC.DACB_COMMAND, binaryB // 256, binaryB % 256]
+            )
+            self.binaryB = binaryB
+
+    def update(self, dacA, dacB, force=False):
+        """Updates the voltages on the LJTick-DAC.
+        dacA: The DACA voltage to set.
+        dacB: The DACB voltage to set.
+        force: Write even if the binary codes haven't changed.
+
+        Channels whose binary code hasn't changed since the last write are
+        skipped.
+
+        """
+        binaryA = self.toBinaryA(dacA)
+        binaryB = self.toBinaryB(dacB)
+        changedA = force or binaryA != self.binaryA
+        changedB = force or binaryB != self.binaryB
+
+        if self.batched and changedA and changedB:
+            self.writeDAC(
+                [
+                    LJTickDAC.DACA_COMMAND,
+                    binaryA // 256,
+                    binaryA % 256,
+                    LJTickDAC.DACB_COMMAND,
+                    binaryB // 256,
+                    binaryB % 256,
+                ]
+            )
+            self.binaryA = binaryA
+            self.binaryB = binaryB
+        else:
+            self.updateA(dacA, force)
+            self.updateB(dacB, force)
@@ -1,116 +1,266 @@
-import csv
 from datetime import datetime
 import os
 import time
-import tkinter as tk
-from tkinter import ttk
 from labjack import ljm
+import numpy as np
 import yaml
 import threading
+import datalogger
+import ljmstream
+import telemetry
 
 
-# Load config file
-program_path = os.path.dirname(os.path.realpath(__file__))
-with open("mfc_config.yml", "r", encoding="utf-8") as f:
-    config = yaml.safe_load(f)
-
-num_mfc = config["num_mfc"]
-
-# Create file
-start_time = datetime.now()
-current_date = start_time.strftime("%Y-%m-%d")
-subfolder_path = os.path.join(os.getcwd(), current_date)
-os.makedirs(subfolder_path, exist_ok=True)
-
-# Create CSV file and writer
-file_datetime = start_time.strftime("%Y%m%d_%H%M%S")
-csv_filename = "MFC_" + file_datetime + ".csv"
-csv_filepath = os.path.join(subfolder_path, csv_filename)
-
-# Create file header
-header = ["datetime"]
-for i in range(num_mfc):
-    header.append(config[f"mfc{i+1}"]["name"] + "_setpoint")
-    header.append(config[f"mfc{i+1}"]["name"] + "_flowrate")
-
-# Write CSV header
-with open(csv_filepath, mode="w", newline="") as data_file:
-    data_writer = csv.writer(data_file, delimiter=",")
-    data_writer.writerow(header)
-
-# Set the MFCs
-handle = ljm.openS("ANY", "ANY", "ANY")
-for i in range(num_mfc):
-    mfc = config[f"mfc{i+1}"]
-    setpoint = mfc["setpoint"]
-    scale = mfc["scale"]
-    offset = mfc["offset"]
-    ljm.eWriteName(handle, mfc["flow_set"], (setpoint - offset) / scale)
-
-# Tkinter GUI setup
-root = tk.Tk()
-root.title("MFC Controller")
-
-# Create MFC frames
-mfc_labels = {}
-mfc_setpoints = {}
-mfc_flows = {}
-
-for i in range(num_mfc):
-    mfc_name = config[f"mfc{i+1}"]["name"]
-    frame = ttk.Frame(root, padding=10)
-    frame.grid(row=i, column=0, sticky="w")
-
-    mfc_label = ttk.Label(
-        frame, text=f"{mfc_name}:", font=("Arial", 12, "bold")
-    )
-    mfc_label.grid(row=0, column=0, sticky="w")
-
-    setpoint_label = ttk.Label(
-        frame, text=f"Setpoint: {config[f'mfc{i+1}']['setpoint']}"
-    )
-    setpoint_label.grid(row=1, column=0, sticky="w")
-    mfc_setpoints[mfc_name] = setpoint_label
-
-    flow_label = ttk.Label(frame, text="Flowrate: 0")
-    flow_label.grid(row=2, column=0, sticky="w")
-    mfc_flows[mfc_name] = flow_label
-
-import random
-
-
-def update_mfc_data():
-    while True:
+def load_config(config_path="mfc_config.yml"):
+    with open(config_path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+class MFCController:
+    """Sets the MFC flows on a T7 and logs the measured flow rates."""
+
+    def __init__(self, config, handle=None, ljm_api=ljm):
+        """config: The loaded mfc_config.yml.
+        handle: An open LJM handle, a T7 is opened if None.
+        ljm_api: The module the T7 is read and set through, e.g. a
+            devicebroker.LJMProxy when the T7 is shared.
+
+        """
+        self.config = config
+        self.num_mfc = config["num_mfc"]
+        self.mfcs = [config[f"mfc{i+1}"] for i in range(self.num_mfc)]
+
+        # Channel lists so all MFCs are read or set in one LJM call
+        self.read_names = [mfc["flow_read"] for mfc in self.mfcs]
+        self.set_names = [mfc["flow_set"] for mfc in self.mfcs]
+        self.set_values = [
+            (mfc["setpoint"] - mfc["offset"]) / mfc["scale"]
+            for mfc in self.mfcs
+        ]
+
+        # In stream mode the flows are sampled at stream_rate and each row
+        # holds the mean, std, min and max over the read interval
+        self.stream_config = config.get("stream", {})
+        self.use_stream = self.stream_config.get("enabled", False)
+
+        # Create file header
+        header = ["datetime"]
+        for mfc in self.mfcs:
+            header.append(mfc["name"] + "_setpoint")
+            header.append(mfc["name"] + "_flowrate")
+            if self.use_stream:
+                header.append(mfc["name"] + "_flowrate_std")
+                header.append(mfc["name"] + "_flowrate_min")
+                header.append(mfc["name"] + "_flowrate_max")
+
+        # Create CSV (or columnar) writer, a new file is started in a new
+        # date folder each day
+        self.data_writer = datalogger.open_writer(
+            os.path.join(os.getcwd(), "%Y-%m-%d", "MFC_%Y%m%d_%H%M%S.csv"),
+            header,
+            backend=config.get("log_backend", "csv"),
+            skip=["datetime"],
+            flush_rows=config.get("flush_rows", 60),
+            flush_interval=config.get("flush_interval", 10),
+            fsync=config.get("fsync", False),
+            rollups=config.get("rollups"),
+        )
+
+        # Flow rates go from the data thread to the GUI through the bus
+        self.telemetry_bus = telemetry.TelemetryBus()
+
+        if handle is None:
+            handle = ljm.openS("ANY", "ANY", "ANY")
+        self.handle = handle
+        self.ljm = ljm_api
+        self.running = False
+        self.data_thread = None
+
+    def start(self):
+        """Sets the MFCs and starts logging on a separate thread."""
+        self.ljm.eWriteNames(
+            self.handle, self.num_mfc, self.set_names, self.set_values
+        )
+        self.running = True
+        self.data_thread = threading.Thread(
+            target=(
+                self.update_mfc_stream_data
+                if self.use_stream
+                else self.update_mfc_data
+            ),
+            daemon=True,
+        )
+        self.data_thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.data_thread is not None:
+            self.data_thread.join()
+            self.data_thread = None
+        self.data_writer.close()
+
+    def update_mfc_data(self):
+        while self.running:
+            try:
+                now = datetime.now()
+                data = [now]
+                readings = self.ljm.eReadNames(
+                    self.handle, self.num_mfc, self.read_names
+                )
+                for mfc, reading in zip(self.mfcs, readings):
+                    mfc_name = mfc["name"]
+                    flowrate = reading * mfc["scale"] + mfc["offset"]
+                    # flowrate = random.randint(0, 100)
+
+                    # Update flow rate in the GUI
+                    self.telemetry_bus.publish(mfc_name, flowrate)
+
+                    data.append(mfc["setpoint"])
+                    data.append(flowrate)
+
+                # Write data to CSV
+                self.data_writer.writerow(data, now)
+
+                # Wait for the next read
+                time.sleep(self.config["read_interval"])
+            except:
+                pass
+
+    def open_stream(self, report=True):
+        """Starts streaming the flow channels, returns the LJMStreamStats
+        or None if the stream didn't start.
+
+        """
+        stream = ljmstream.LJMStreamStats(
+            self.handle,
+            self.read_names,
+            self.stream_config.get("scan_rate", 100),
+            ljm_api=self.ljm,
+        )
         try:
-            data = [datetime.now()]
-            for i in range(num_mfc):
-                mfc_name = config[f"mfc{i+1}"]["name"]
-                mfc = config[f"mfc{i+1}"]
-                scale = mfc["scale"]
-                offset = mfc["offset"]
-                flowrate = ljm.eReadName(handle, mfc["flow_read"]) * scale + offset
-                # flowrate = random.randint(0, 100)
-
-                # Update flow rate in the GUI
-                mfc_flows[mfc_name].config(text=f"Flowrate: {flowrate}")
-
-                data.append(mfc["setpoint"])
-                data.append(flowrate)
-
-            # Write data to CSV
-            with open(csv_filepath, mode="a", newline="") as data_file:
-                data_writer = csv.writer(data_file, delimiter=",")
-                data_writer.writerow(data)
-
-            # Wait for the next read
-            time.sleep(config["read_interval"])
-        except:
-            pass
-
-
-# Run data update in a separate thread to keep GUI responsive
-data_thread = threading.Thread(target=update_mfc_data, daemon=True)
-data_thread.start()
-
-# Run the Tkinter event loop
-root.mainloop()
+            stream.start()
+        except self.ljm.LJMError as e:
+            if report:
+                print(f"{datetime.now()}: MFC stream didn't start: {e}")
+            return None
+        return stream
+
+    def read_flow_stats(self):
+        """One eReadNames read of the flows, as LJMStreamStats.collect()
+        statistics.
+
+        """
+        readings = np.asarray(
+            self.ljm.eReadNames(self.handle, self.num_mfc, self.read_names),
+            dtype=float,
+        )
+        return {
+            "count": np.ones(self.num_mfc),
+            "mean": readings,
+            "std": np.zeros(self.num_mfc),
+            "min": readings,
+            "max": readings,
+        }
+
+    def update_mfc_stream_data(self):
+        read_interval = self.config["read_interval"]
+        stream = self.open_stream()
+        next_read = time.monotonic() + read_interval
+        while self.running:
+            try:
+                time.sleep(max(next_read - time.monotonic(), 0))
+                next_read += read_interval
+                now = datetime.now()
+                if stream is None:
+                    stream = self.open_stream(report=False)
+                    if stream is not None:
+                        print(f"{now}: MFC stream restarted")
+                stats = stream.collect() if stream is not None else None
+                if stream is not None and stream.error is not None:
+                    print(f"{now}: MFC stream stopped: {stream.error}")
+                    stream.stop()
+                    stream = self.open_stream()
+                if stats is None or not stats["count"].any():
+                    # No stream data this interval, log a single read
+                    stats = self.read_flow_stats()
+                data = [now]
+                for i, mfc in enumerate(self.mfcs):
+                    scale = mfc["scale"]
+                    offset = mfc["offset"]
+                    flowrate = stats["mean"][i] * scale + offset
+
+                    # Update flow rate in the GUI
+                    self.telemetry_bus.publish(mfc["name"], flowrate)
+
+                    data.append(mfc["setpoint"])
+                    data.append(flowrate)
+                    data.append(stats["std"][i] * abs(scale))
+                    data.append(stats["min"][i] * scale + offset)
+                    data.append(stats["max"][i] * scale + offset)
+
+                # Write data to CSV
+                self.data_writer.writerow(data, now)
+            except Exception as e:
+                print(f"{datetime.now()}: MFC logging error: {e!r}")
+        if stream is not None:
+            stream.stop()
+
+
+def run_gui(controller):
+    """Shows the setpoints and flow rates until the window is closed."""
+    import tkinter as tk
+    from tkinter import ttk
+
+    # Tkinter GUI setup
+    root = tk.Tk()
+    root.title("MFC Controller")
+
+    # Create MFC frames
+    for i, mfc in enumerate(controller.mfcs):
+        mfc_name = mfc["name"]
+        frame = ttk.Frame(root, padding=10)
+        frame.grid(row=i, column=0, sticky="w")
+
+        mfc_label = ttk.Label(
+            frame, text=f"{mfc_name}:", font=("Arial", 12, "bold")
+        )
+        mfc_label.grid(row=0, column=0, sticky="w")
+
+        setpoint_label = ttk.Label(frame, text=f"Setpoint: {mfc['setpoint']}")
+        setpoint_label.grid(row=1, column=0, sticky="w")
+
+        flow_label = ttk.Label(frame, text="Flowrate: 0")
+        flow_label.grid(row=2, column=0, sticky="w")
+        controller.telemetry_bus.subscribe(
+            mfc_name,
+            lambda flowrate, label=flow_label: label.config(
+                text=f"Flowrate: {flowrate}"
+            ),
+        )
+
+    # Update the GUI with the newest flow rates five times a second
+    controller.telemetry_bus.attach(root, 200)
+
+    # Run the Tkinter event loop
+    root.mainloop()
+
+
+def main(headless=False, config_path="mfc_config.yml", handle=None):
+    """Runs the MFC controller, with a GUI unless headless."""
+    controller = MFCController(load_config(config_path), handle)
+
+    # Run data update in a separate thread to keep GUI responsive
+    controller.start()
+    try:
+        if headless:
+            while True:
+                time.sleep(1)
+        else:
+            run_gui(controller)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
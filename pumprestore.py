@@ -2,23 +2,43 @@ import time
 
 from labjack import ljm
 
-# Load Labjack
-handle = ljm.openS("T7", "ANY", "ANY")
 relay_input = "DIO6"
 
-try:
-    while True:
+
+def pulse_relay(handle, ljm_api=ljm, stop=None):
+    """Opens and closes the valve every 0.1 s until stop() returns True.
+
+    ljm_api: The module the T7 is set through, e.g. a devicebroker.LJMProxy
+        when the T7 is shared.
+
+    """
+    try:
+        while stop is None or not stop():
+            # Close valve
+            ljm_api.eWriteName(handle, relay_input, 0)
+            time.sleep(0.1)
+
+            # Open valve
+            ljm_api.eWriteName(handle, relay_input, 1)
+            time.sleep(0.1)
+    finally:
         # Close valve
-        ljm.eWriteName(handle, relay_input, 0)
+        ljm_api.eWriteName(handle, relay_input, 0)
         time.sleep(0.1)
 
-        # Open valve
-        ljm.eWriteName(handle, relay_input, 1)
-        time.sleep(0.1)
-except KeyboardInterrupt:
-    # Close valve
-    ljm.eWriteName(handle, relay_input, 0)
-    time.sleep(0.1)
+
+def main(handle=None):
+    # Load Labjack
+    if handle is None:
+        handle = ljm.openS("T7", "ANY", "ANY")
+    try:
+        pulse_relay(handle)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
 
 
 # import time
@@ -0,0 +1,197 @@
+import bisect
+import math
+from collections import deque
+
+
+class RingBuffer:
+    """Fixed-capacity sample window with O(1) running statistics.
+
+    The sum and sum of squares are updated as samples enter and leave the
+    window, and min/max are tracked with monotonic queues, so none of the
+    statistics rescan the window.
+
+    """
+
+    def __init__(self, capacity):
+        """capacity: Number of samples kept in the window."""
+        if capacity < 1:
+            raise ValueError("RingBuffer capacity must be at least 1")
+        self.capacity = int(capacity)
+        self._data = [0.0] * self.capacity
+        self._start = 0
+        self._count = 0
+        self._seq = 0
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._since_resum = 0
+        self._min = deque()  # (seq, value), values increasing
+        self._max = deque()  # (seq, value), values decreasing
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        """Adds a sample, dropping the oldest one if the window is full."""
+        value = float(value)
+        if self._count == self.capacity:
+            old = self._data[self._start]
+            self._sum -= old
+            self._sumsq -= old * old
+            self._data[self._start] = value
+            self._start = (self._start + 1) % self.capacity
+        else:
+            self._data[(self._start + self._count) % self.capacity] = value
+            self._count += 1
+        self._sum += value
+        self._sumsq += value * value
+
+        oldest = self._seq - self._count + 1
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((self._seq, value))
+        while self._min[0][0] < oldest:
+            self._min.popleft()
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((self._seq, value))
+        while self._max[0][0] < oldest:
+            self._max.popleft()
+        self._seq += 1
+
+        # Re-add the window now and then so rounding errors don't build up
+        self._since_resum += 1
+        if self._since_resum >= 16 * self.capacity:
+            self._resum()
+
+    def extend(self, values):
+        """Adds a block of samples."""
+        for value in values:
+            self.append(value)
+
+    def clear(self):
+        self.__init__(self.capacity)
+
+    def values(self):
+        """Returns the samples in the window, oldest first."""
+        end = self._start + self._count
+        if end <= self.capacity:
+            return self._data[self._start : end]
+        return self._data[self._start :] + self._data[: end - self.capacity]
+
+    def last(self, n):
+        """Returns the newest `n` samples, oldest first."""
+        return self.values()[-n:] if n > 0 else []
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def mean(self):
+        if self._count == 0:
+            return math.nan
+        return self._sum / self._count
+
+    @property
+    def variance(self):
+        """Population variance of the window."""
+        if self._count == 0:
+            return math.nan
+        mean = self._sum / self._count
+        return max(self._sumsq / self._count - mean * mean, 0.0)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._count else math.nan
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._count else math.nan
+
+    def _resum(self):
+        values = self.values()
+        self._sum = math.fsum(values)
+        self._sumsq = math.fsum(v * v for v in values)
+        self._since_resum = 0
+
+
+class RunningMedian:
+    """Median of the last `n` samples, kept in a sorted window."""
+
+    def __init__(self, n):
+        self.n = int(n)
+        self._window = deque()
+        self._sorted = []
+
+    def append(self, value):
+        value = float(value)
+        self._window.append(value)
+        bisect.insort(self._sorted, value)
+        if len(self._window) > self.n:
+            old = self._window.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+
+    @property
+    def value(self):
+        count = len(self._sorted)
+        if count == 0:
+            return math.nan
+        mid = count // 2
+        if count % 2:
+            return self._sorted[mid]
+        return (self._sorted[mid - 1] + self._sorted[mid]) / 2
+
+
+class SignalFilter:
+    """Smooths a sampled signal with a boxcar, EMA or median-of-N filter.
+
+    All samples also go into a RingBuffer of `window` samples, so the
+    running statistics are available whichever filter is selected.
+
+    """
+
+    MODES = ("boxcar", "ema", "median")
+
+    def __init__(self, window, mode="boxcar", alpha=None, median_n=5):
+        """window: Number of samples in the boxcar/statistics window.
+        mode: "boxcar", "ema" or "median".
+        alpha: EMA smoothing factor, defaults to 2 / (window + 1).
+        median_n: Number of samples in the median filter.
+
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown filter mode: {mode}")
+        self.mode = mode
+        self.buffer = RingBuffer(window)
+        self.alpha = 2 / (window + 1) if alpha is None else alpha
+        self.ema = math.nan
+        self.median = RunningMedian(median_n) if mode == "median" else None
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def append(self, value):
+        self.buffer.append(value)
+        if math.isnan(self.ema):
+            self.ema = float(value)
+        else:
+            self.ema += self.alpha * (value - self.ema)
+        if self.median is not None:
+            self.median.append(value)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    @property
+    def value(self):
+        """Filtered value, NaN before the first sample."""
+        if self.mode == "ema":
+            return self.ema
+        if self.mode == "median":
+            return self.median.value
+        return self.buffer.mean
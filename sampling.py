@@ -0,0 +1,91 @@
+import argparse
+import importlib
+import os
+import sys
+
+# Instrument name to the module that runs it. Modules are only imported
+# when selected, so one instrument's dependencies don't load for another.
+INSTRUMENTS = {
+    "blower": "blower_box_final",
+    "mfc": "mfc_control",
+    "ion": "ion_precipitator",
+    "wind": "capturewind_graph",
+    "camera": "captureimg",
+}
+
+
+def has_display():
+    if sys.platform.startswith("win") or sys.platform == "darwin":
+        return True
+    return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run a sampling instrument")
+    subparsers = parser.add_subparsers(dest="instrument", required=True)
+
+    def add_instrument(name, help):
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.add_argument(
+            "--headless",
+            action="store_true",
+            help="Log without a GUI (default when there is no display)",
+        )
+        return subparser
+
+    add_instrument("blower", "Blower PID controller (always headless)")
+
+    mfc_parser = add_instrument("mfc", "MFC controller")
+    mfc_parser.add_argument("--config", default="mfc_config.yml")
+
+    ion_parser = add_instrument("ion", "Ion precipitator voltage toggling")
+    ion_parser.add_argument("--set-voltage", type=float, default=1000.0)
+    ion_parser.add_argument("--toggle-time", type=float, default=30.0)
+
+    wind_parser = add_instrument("wind", "Anemometer logger")
+    wind_parser.add_argument("--port", default="COM3")
+    wind_parser.add_argument(
+        "--log-backend", choices=["csv", "columnar"], default="csv"
+    )
+    wind_parser.add_argument(
+        "--redraw-ms", type=int, default=1000, help="Plot redraw interval"
+    )
+    wind_parser.add_argument(
+        "--rose-minutes",
+        type=float,
+        default=None,
+        help="Draw a wind rose of the last N minutes",
+    )
+
+    camera_parser = add_instrument("camera", "Webcam image capture")
+    camera_parser.add_argument("--interval", type=float, default=5)
+    return parser
+
+
+def run(args):
+    headless = args.headless or not has_display()
+    module = importlib.import_module(INSTRUMENTS[args.instrument])
+    if args.instrument == "blower":
+        module.main()
+    elif args.instrument == "mfc":
+        module.main(headless=headless, config_path=args.config)
+    elif args.instrument == "ion":
+        module.main(
+            headless=headless,
+            set_voltage=args.set_voltage,
+            toggle_time=args.toggle_time,
+        )
+    elif args.instrument == "wind":
+        module.main(
+            headless=headless,
+            port=args.port,
+            log_backend=args.log_backend,
+            redraw_interval=args.redraw_ms,
+            rose_minutes=args.rose_minutes,
+        )
+    elif args.instrument == "camera":
+        module.main(headless=headless, interval=args.interval)
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,151 @@
+import math
+import threading
+import time
+
+
+class TaskStats:
+    """Timing statistics for one periodic task."""
+
+    def __init__(self):
+        self.runs = 0
+        self.skipped = 0
+        self.max_lateness = 0.0
+        self.max_duration = 0.0
+        self._lateness_sum = 0.0
+        self._lateness_sumsq = 0.0
+
+    def record(self, lateness, duration):
+        """lateness: How long after its slot's start time the run started.
+        duration: How long the run took.
+
+        """
+        self.runs += 1
+        self._lateness_sum += lateness
+        self._lateness_sumsq += lateness * lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.max_duration = max(self.max_duration, duration)
+
+    @property
+    def mean_lateness(self):
+        return self._lateness_sum / self.runs if self.runs else math.nan
+
+    @property
+    def jitter_std(self):
+        """Spread of the start times around their slots' start times, so
+        skipped slots don't count as jitter.
+
+        """
+        if self.runs < 2:
+            return math.nan
+        mean = self._lateness_sum / self.runs
+        variance = self._lateness_sumsq / self.runs - mean * mean
+        return math.sqrt(max(variance, 0.0))
+
+    def __repr__(self):
+        return (
+            f"runs={self.runs} skipped={self.skipped} "
+            f"lateness(mean/max)={self.mean_lateness:.4f}/"
+            f"{self.max_lateness:.4f}s jitter(std)={self.jitter_std:.4f}s "
+            f"duration(max)={self.max_duration:.4f}s"
+        )
+
+
+class PeriodicTask:
+    def __init__(self, name, period, func, args, kwargs, overrun, start):
+        self.name = name
+        self.period = period
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.overrun = overrun
+        self.next_run = start
+        self.stats = TaskStats()
+
+
+class Scheduler:
+    """Runs periodic tasks on the monotonic clock.
+
+    Each task's run times are fixed multiples of its period from when it
+    was added, so tasks don't drift. Tasks run one at a time on the thread
+    that calls run(). When a task falls more than a period behind (its
+    own or another task's run took too long), the overrun policy decides
+    what happens: "skip" drops the missed runs and waits for the next
+    slot, "catchup" runs the missed runs back to back.
+
+    """
+
+    OVERRUN_POLICIES = ("skip", "catchup")
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.tasks = []
+        self._stop = threading.Event()
+
+    def every(self, period, func, *args, name=None, overrun="skip", **kwargs):
+        """Adds func(*args, **kwargs) to run every `period` seconds.
+
+        The first run is right away. Returns the PeriodicTask.
+
+        """
+        if period <= 0:
+            raise ValueError("Task period must be positive")
+        if overrun not in self.OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy: {overrun}")
+        task = PeriodicTask(
+            name or getattr(func, "__name__", repr(func)),
+            period,
+            func,
+            args,
+            kwargs,
+            overrun,
+            self.clock(),
+        )
+        self.tasks.append(task)
+        return task
+
+    def run_pending(self):
+        """Runs every task that is due, then returns."""
+        for task in sorted(self.tasks, key=lambda t: t.next_run):
+            now = self.clock()
+            if now < task.next_run:
+                continue
+            lateness = now - task.next_run
+            task.func(*task.args, **task.kwargs)
+            end = self.clock()
+            task.stats.record(lateness, end - now)
+
+            task.next_run += task.period
+            # Finishing right at the next slot's start isn't late for it
+            if task.overrun == "skip" and end > task.next_run:
+                missed = math.floor((end - task.next_run) / task.period) + 1
+                task.next_run += missed * task.period
+                task.stats.skipped += missed
+
+    def time_to_next(self):
+        """Returns seconds until the next task is due (0 if overdue)."""
+        if not self.tasks:
+            return None
+        next_run = min(task.next_run for task in self.tasks)
+        return max(next_run - self.clock(), 0.0)
+
+    def run(self, stop=None):
+        """Runs tasks until stop() is called or stop() returns True.
+
+        stop: Optional callable checked between tasks.
+
+        """
+        self._stop.clear()
+        while not self._stop.is_set() and not (stop and stop()):
+            self.run_pending()
+            wait = self.time_to_next()
+            if wait is None:
+                break
+            if wait > 0:
+                self._stop.wait(wait)
+
+    def stop(self):
+        self._stop.set()
+
+    def report(self):
+        """Returns one line of timing statistics per task."""
+        return "\n".join(f"{t.name}: {t.stats}" for t in self.tasks)
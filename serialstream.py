@@ -0,0 +1,129 @@
+import queue
+import threading
+import time
+
+
+class FrameParser:
+    """Splits a serial byte stream into delimiter-terminated frames.
+
+    Bytes are fed in whatever chunks the port returns, so a frame can
+    arrive in pieces; the unfinished tail is kept until its delimiter
+    comes. Frames the parse function rejects are dropped, and so is data
+    that grows past max_length without a delimiter, so the parser resyncs
+    on the next delimiter after line noise.
+
+    """
+
+    def __init__(self, parse, delimiter=b"\r", max_length=256):
+        """parse: Callable taking the decoded, stripped frame text and
+            returning a record, raising ValueError for a bad frame.
+        delimiter: Bytes ending each frame.
+        max_length: Longest frame kept without a delimiter.
+
+        """
+        self.parse = parse
+        self.delimiter = delimiter
+        self.max_length = max_length
+        self.frames = 0
+        self.dropped = 0
+        self._buffer = bytearray()
+
+    def reset(self):
+        """Drops the unfinished frame."""
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Adds received bytes, returns the records completed by them."""
+        self._buffer += data
+        *frames, tail = self._buffer.split(self.delimiter)
+        if len(tail) > self.max_length:
+            self.dropped += 1
+            tail = b""
+        self._buffer = bytearray(tail)
+
+        records = []
+        for frame in frames:
+            text = frame.decode("utf-8", "replace").strip()
+            if not text:
+                continue
+            try:
+                records.append(self.parse(text))
+            except ValueError:
+                self.dropped += 1
+                continue
+            self.frames += 1
+        return records
+
+
+class SerialReader:
+    """Reads a serial port on a background thread and puts each parsed
+    record on a queue as (timestamp, record).
+
+    Each read takes everything the port has buffered, or waits up to the
+    port's timeout for the first byte, so a quiet sensor costs no CPU and
+    never blocks the consumer.
+
+    """
+
+    def __init__(self, ser, parser, maxsize=10000):
+        """ser: An open serial.Serial with a read timeout.
+        parser: A FrameParser.
+        maxsize: Records kept if the consumer falls behind (newer records
+            are dropped while the queue is full).
+
+        """
+        self.ser = ser
+        self.parser = parser
+        self.queue = queue.Queue(maxsize)
+        self.overflows = 0
+        self.error = None
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get(self, timeout=None):
+        """Returns the next (timestamp, record), raises queue.Empty after
+        timeout seconds without one.
+
+        """
+        return self.queue.get(timeout=timeout)
+
+    def drain(self):
+        """Returns all queued (timestamp, record) pairs without waiting."""
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _run(self):
+        while self.running:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                self.error = e
+                self.running = False
+                break
+            if not data:
+                # A pause longer than the timeout, don't join a stale
+                # partial frame to the next one
+                self.parser.reset()
+                continue
+            timestamp = time.time()
+            for record in self.parser.feed(data):
+                try:
+                    self.queue.put_nowait((timestamp, record))
+                except queue.Full:
+                    self.overflows += 1
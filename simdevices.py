@@ -0,0 +1,578 @@
+import math
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import tty
+import types
+
+# LJTick-DAC constants served from the simulated EEPROM, +-10 V over 16 bits
+TDAC_SLOPE = 65536 / 20.0
+TDAC_OFFSET = 32768.0
+# Single-ended range of the U3 low-voltage analog inputs
+U3_AIN_RANGE = 2.44
+
+
+def _value(signal, t):
+    """A signal is a number or a callable of seconds since the device was
+    opened.
+
+    """
+    return signal(t) if callable(signal) else signal
+
+
+class FakeU3:
+    """Simulated LabJack U3 for running the instrument scripts without
+    hardware.
+
+    Supports the calls the scripts make: getFeedback with AIN, Timer,
+    Counter and TimerConfig commands, getAIN, i2c to an LJTick-DAC
+    (EEPROM calibration reads and DAC writes), streaming and the config
+    calls. Every USB transaction sleeps for `latency` seconds.
+
+    The counter follows the blower: it counts 6 pulses per revolution at
+    rpm_per_volt times the DACA voltage of the LJTick-DAC on rpm_pin.
+
+    """
+
+    def __init__(
+        self,
+        latency=0.0008,
+        noise=0.002,
+        ain=None,
+        rpm_pin=6,
+        rpm_per_volt=600.0,
+        serialNumber=320000001,
+        **kwargs,
+    ):
+        """latency: Seconds per USB transaction.
+        noise: Standard deviation (V) of gaussian noise on analog inputs.
+        ain: Dict of analog input channel to signal (volts or a callable
+            of seconds since open), channels not listed read 0 V.
+        rpm_pin: DIO pin of the LJTick-DAC driving the blower.
+        rpm_per_volt: Blower speed per DACA volt.
+        kwargs: u3.U3() open arguments, ignored.
+
+        """
+        self.latency = latency
+        self.noise = noise
+        self.ain = {1: 1.5} if ain is None else dict(ain)
+        self.rpm_pin = rpm_pin
+        self.rpm_per_volt = rpm_per_volt
+        self.serialNumber = serialNumber
+        self.isHV = False
+        self.calData = {}
+        self.transactions = 0
+
+        # Voltages written to LJTick-DACs by (SCL pin, "A" or "B")
+        self.dac = {}
+        self.io = {}
+        self.streamStarted = False
+        self.packetsPerRequest = 48
+        self._stream = {}
+
+        self._lock = threading.Lock()
+        self._opened = time.monotonic()
+        self._count = 0.0
+        self._count_time = self._opened
+
+    def _transaction(self):
+        with self._lock:
+            self.transactions += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _elapsed(self):
+        return time.monotonic() - self._opened
+
+    def _ain_volts(self, channel):
+        volts = _value(self.ain.get(channel, 0.0), self._elapsed())
+        if self.noise:
+            volts += random.gauss(0.0, self.noise)
+        return min(max(volts, 0.0), U3_AIN_RANGE)
+
+    def _advance_counter(self):
+        now = time.monotonic()
+        rpm = self.rpm_per_volt * self.dac.get((self.rpm_pin, "A"), 0.0)
+        self._count += max(rpm, 0.0) / 60 * 6 * (now - self._count_time)
+        self._count_time = now
+
+    def getCalibrationData(self):
+        self._transaction()
+        return self.calData
+
+    def configIO(self, **kwargs):
+        self._transaction()
+        self.io.update(
+            {key: value for key, value in kwargs.items() if value is not None}
+        )
+        return dict(self.io)
+
+    def configTimerClock(self, TimerClockBase=None, TimerClockDivisor=None):
+        self._transaction()
+        return {}
+
+    def getFeedback(self, *commandlist):
+        self._transaction()
+        commands = []
+        for command in commandlist:
+            if isinstance(command, (list, tuple)):
+                commands.extend(command)
+            else:
+                commands.append(command)
+
+        results = []
+        for command in commands:
+            kind = type(command).__name__
+            if kind == "AIN":
+                volts = self._ain_volts(command.positiveChannel)
+                results.append(int(volts / U3_AIN_RANGE * 65535))
+            elif kind.startswith("Timer") and kind != "TimerConfig":
+                # Mode 10, low 32 bits of the 4 MHz system timer
+                results.append(int(self._elapsed() * 4e6) & 0xFFFFFFFF)
+            elif kind.startswith("Counter"):
+                self._advance_counter()
+                results.append(int(self._count))
+            elif kind in ("TimerConfig", "BitStateWrite", "BitDirWrite"):
+                results.append(None)
+            else:
+                raise ValueError(f"FakeU3 doesn't simulate {kind}")
+        return results
+
+    def binaryToCalibratedAnalogVoltage(
+        self,
+        bits,
+        isLowVoltage=True,
+        isSingleEnded=True,
+        isSpecialSetting=False,
+        channelNumber=0,
+    ):
+        return bits / 65535 * U3_AIN_RANGE
+
+    def getAIN(
+        self, posChannel, negChannel=31, longSettle=False, quickSample=False
+    ):
+        self._transaction()
+        bits = int(self._ain_volts(posChannel) / U3_AIN_RANGE * 65535)
+        return self.binaryToCalibratedAnalogVoltage(bits)
+
+    def i2c(
+        self,
+        Address,
+        I2CBytes,
+        EnableClockStretching=False,
+        NoStopWhenRestarting=False,
+        ResetAtStart=False,
+        SpeedAdjust=0,
+        SDAPinNum=6,
+        SCLPinNum=7,
+        NumI2CBytesToReceive=0,
+        AddressByte=None,
+    ):
+        self._transaction()
+        received = [0] * NumI2CBytesToReceive
+        if Address == 0x50:
+            # LJTick-DAC EEPROM: slopeA, offsetA, slopeB, offsetB
+            eeprom = []
+            for constant in (TDAC_SLOPE, TDAC_OFFSET) * 2:
+                whole = math.floor(constant)
+                fraction = int((constant - whole) * 2**32)
+                eeprom += list(struct.pack("<Ii", fraction, whole))
+            received = (eeprom + received)[:NumI2CBytesToReceive]
+        elif Address == 0x12:
+            # LJTick-DAC: [command, high byte, low byte] per channel
+            self._advance_counter()
+            for i in range(0, len(I2CBytes) - 2, 3):
+                command, high, low = I2CBytes[i : i + 3]
+                channel = "A" if command == 48 else "B"
+                volts = (high * 256 + low - TDAC_OFFSET) / TDAC_SLOPE
+                self.dac[(SCLPinNum, channel)] = volts
+        return {
+            "AckArray": [0xFF] * 4,
+            "I2CBytes": received,
+            "NumAcks": len(I2CBytes) + 1,
+        }
+
+    def streamConfig(
+        self,
+        NumChannels=1,
+        SamplesPerPacket=25,
+        InternalStreamClockFrequency=0,
+        DivideClockBy256=False,
+        Resolution=3,
+        ScanInterval=1,
+        PChannels=[30],
+        NChannels=[31],
+        ScanFrequency=None,
+        SampleFrequency=None,
+    ):
+        self._transaction()
+        if ScanFrequency is None:
+            ScanFrequency = (SampleFrequency or 1000) / NumChannels
+        self._stream = {
+            "channels": list(PChannels[:NumChannels]),
+            "scan_rate": ScanFrequency,
+            "samples_per_packet": SamplesPerPacket,
+        }
+
+    def streamStart(self):
+        self._transaction()
+        self.streamStarted = True
+
+    def streamStop(self):
+        self._transaction()
+        self.streamStarted = False
+
+    def streamData(self, convert=True):
+        """Yields a block of scans every packetsPerRequest packets, paced
+        at the configured scan rate.
+
+        """
+        channels = self._stream["channels"]
+        scan_rate = self._stream["scan_rate"]
+        scans = max(
+            1,
+            self.packetsPerRequest
+            * self._stream["samples_per_packet"]
+            // len(channels),
+        )
+        packet = 0
+        deadline = time.monotonic()
+        while self.streamStarted:
+            deadline += scans / scan_rate
+            time.sleep(max(deadline - time.monotonic(), 0))
+            result = {
+                "errors": 0,
+                "missed": 0,
+                "numPackets": self.packetsPerRequest,
+                "firstPacket": packet % 256,
+            }
+            for channel in channels:
+                result[f"AIN{channel}"] = [
+                    self._ain_volts(channel) for _ in range(scans)
+                ]
+            packet += self.packetsPerRequest
+            yield result
+
+    def close(self):
+        self.streamStarted = False
+
+
+class LJMError(Exception):
+    pass
+
+
+class FakeLJM:
+    """Simulated labjack.ljm module with T7s behind it.
+
+    Reads of AINn return the last value written to TDACn (or DACn), so a
+    simulated MFC follows its setpoint, unless a signal is given for that
+    name. Each call sleeps for `latency` seconds.
+
+    """
+
+    constants = types.SimpleNamespace(DUMMY_VALUE=-9999.0)
+    LJMError = LJMError
+
+    def __init__(self, latency=0.0005, noise=0.002, signals=None):
+        """latency: Seconds per call to the device.
+        noise: Standard deviation of gaussian noise on AIN reads.
+        signals: Dict of register name to signal (a number or a callable
+            of seconds since open).
+
+        """
+        self.latency = latency
+        self.noise = noise
+        self.signals = dict(signals or {})
+        self.registers = {}
+        self.calls = 0
+        self._handles = {}
+        self._addresses = {}
+        self._names = {}
+        self._opened = time.monotonic()
+
+    def _call(self, handle):
+        if handle not in self._handles:
+            raise LJMError(f"Invalid handle {handle}")
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _read(self, name):
+        if name in self.signals:
+            value = _value(self.signals[name], time.monotonic() - self._opened)
+        elif name.startswith("AIN"):
+            n = name[3:]
+            value = self.registers.get(
+                f"TDAC{n}", self.registers.get(f"DAC{n}", 0.0)
+            )
+        else:
+            return self.registers.get(name, 0.0)
+        if self.noise:
+            value += random.gauss(0.0, self.noise)
+        return value
+
+    def openS(self, deviceType="ANY", connectionType="ANY", identifier="ANY"):
+        handle = len(self._handles) + 1
+        self._handles[handle] = identifier
+        return handle
+
+    def close(self, handle):
+        self._handles.pop(handle, None)
+
+    def eReadName(self, handle, name):
+        self._call(handle)
+        return self._read(name)
+
+    def eReadNames(self, handle, numFrames, aNames):
+        self._call(handle)
+        return [self._read(name) for name in aNames[:numFrames]]
+
+    def eWriteName(self, handle, name, value):
+        self._call(handle)
+        self.registers[name] = value
+
+    def eWriteNames(self, handle, numFrames, aNames, aValues):
+        self._call(handle)
+        for name, value in zip(aNames[:numFrames], aValues):
+            self.registers[name] = value
+
+    def namesToAddresses(self, numFrames, aNames, aNumRegs=None):
+        addresses = []
+        for name in aNames[:numFrames]:
+            if name not in self._addresses:
+                address = 2 * len(self._addresses)
+                self._addresses[name] = address
+                self._names[address] = name
+            addresses.append(self._addresses[name])
+        return addresses, [3] * len(addresses)
+
+    def eStreamStart(
+        self, handle, scansPerRead, numAddresses, aScanList, scanRate
+    ):
+        self._call(handle)
+        self._stream = {
+            "handle": handle,
+            "names": [self._names[a] for a in aScanList[:numAddresses]],
+            "scans_per_read": scansPerRead,
+            "scan_rate": scanRate,
+            "deadline": time.monotonic(),
+        }
+        return scanRate
+
+    def eStreamRead(self, handle):
+        """Blocks until scansPerRead scans are due, like the real call."""
+        stream = self._stream
+        stream["deadline"] += stream["scans_per_read"] / stream["scan_rate"]
+        time.sleep(max(stream["deadline"] - time.monotonic(), 0))
+        data = [
+            self._read(name)
+            for _ in range(stream["scans_per_read"])
+            for name in stream["names"]
+        ]
+        return data, 0, 0
+
+    def eStreamStop(self, handle):
+        self._call(handle)
+
+
+class FakeAnemometer:
+    """Writes "addr speed dir status" frames ending in \\r to a pseudo
+    terminal at `rate` frames per second. Open `port` with serial.Serial
+    like the real sensor (POSIX only).
+
+    """
+
+    def __init__(
+        self,
+        rate=4.0,
+        speed=3.0,
+        direction=180.0,
+        noise=0.5,
+        garbage=0.0,
+        address="Q",
+    ):
+        """rate: Frames per second.
+        speed: Mean wind speed (m/s).
+        direction: Mean direction (degrees).
+        noise: Standard deviation of the speed, the direction's is 10x.
+        garbage: Chance of writing stray bytes before a frame.
+        address: Sensor address field.
+
+        """
+        self.rate = rate
+        self.speed = speed
+        self.direction = direction
+        self.noise = noise
+        self.garbage = garbage
+        self.address = address
+        self.frames = 0
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self.running = False
+        self._thread = None
+
+    def frame(self):
+        speed = max(random.gauss(self.speed, self.noise), 0.0)
+        direction = int(random.gauss(self.direction, 10 * self.noise)) % 360
+        return f"{self.address} {speed:06.2f} {direction:03d} 00\r".encode()
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self):
+        deadline = time.monotonic()
+        while self.running:
+            data = self.frame()
+            if self.garbage and random.random() < self.garbage:
+                data = bytes(random.randrange(256) for _ in range(5)) + data
+            os.write(self._master, data)
+            self.frames += 1
+            deadline += 1 / self.rate
+            time.sleep(max(deadline - time.monotonic(), 0))
+
+
+class FakeVideoCapture:
+    """Synthetic cv2.VideoCapture returning a moving gradient.
+
+    read() takes `latency` seconds, adds gaussian noise with standard
+    deviation `noise` (0 disables it, it costs a lot at 1080p) and fails
+    every `fail_every` frames if set.
+
+    """
+
+    def __init__(self, index=0, latency=1 / 30, noise=0.0, fail_every=0):
+        self.index = index
+        self.latency = latency
+        self.noise = noise
+        self.fail_every = fail_every
+        self.frames = 0
+        self.opened = True
+        self.props = {3: 640, 4: 480}  # CAP_PROP_FRAME_WIDTH/HEIGHT
+        self._base = None
+
+    def isOpened(self):
+        return self.opened
+
+    def set(self, prop, value):
+        self.props[prop] = value
+        self._base = None
+        return True
+
+    def get(self, prop):
+        return self.props.get(prop, 0)
+
+    def read(self):
+        import numpy as np
+
+        if self.latency:
+            time.sleep(self.latency)
+        self.frames += 1
+        if not self.opened or (
+            self.fail_every and self.frames % self.fail_every == 0
+        ):
+            return False, None
+
+        width, height = int(self.props[3]), int(self.props[4])
+        if self._base is None:
+            x = np.linspace(0, 255, width, dtype=np.uint8)
+            y = np.linspace(0, 255, height, dtype=np.uint8)
+            self._base = np.dstack(
+                [
+                    np.broadcast_to(x, (height, width)),
+                    np.broadcast_to(y[:, None], (height, width)),
+                    np.full((height, width), 128, np.uint8),
+                ]
+            )
+        frame = np.roll(self._base, 8 * self.frames, axis=1)
+        if self.noise:
+            frame = np.clip(
+                frame + np.random.normal(0, self.noise, frame.shape), 0, 255
+            ).astype(np.uint8)
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+
+class _Command:
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+class _AIN(_Command):
+    def __init__(self, PositiveChannel, NegativeChannel=31, *args, **kwargs):
+        super().__init__(PositiveChannel, NegativeChannel, *args, **kwargs)
+        self.positiveChannel = PositiveChannel
+        self.negativeChannel = NegativeChannel
+        self.cmdBytes = [1, PositiveChannel, NegativeChannel]
+
+    readLen = 2
+
+
+def install_u3(**options):
+    """Makes u3.U3() return a FakeU3(**options). The command classes come
+    from LabJackPython when it is installed, without the driver.
+
+    """
+    module = types.ModuleType("u3")
+    try:
+        import u3 as real_u3
+
+        module.__dict__.update(vars(real_u3))
+    except Exception:
+        module.AIN = _AIN
+        for name in ("Timer", "Counter", "TimerConfig", "BitStateWrite"):
+            module.__dict__[name] = type(name, (_Command,), {})
+    module.U3 = lambda *args, **kwargs: FakeU3(**{**kwargs, **options})
+    sys.modules["u3"] = module
+    return module
+
+
+def install_ljm(**options):
+    """Makes `from labjack import ljm` return a FakeLJM(**options)."""
+    ljm = FakeLJM(**options)
+    package = types.ModuleType("labjack")
+    package.__path__ = []
+    package.ljm = ljm
+    sys.modules["labjack"] = package
+    sys.modules["labjack.ljm"] = ljm
+    return ljm
+
+
+def install_camera(**options):
+    """Makes cv2.VideoCapture return a FakeVideoCapture(**options)."""
+    import cv2
+
+    cv2.VideoCapture = lambda index=0, *args: FakeVideoCapture(
+        index, **options
+    )
+
+
+def install(u3=None, ljm=None, camera=None):
+    """Installs all simulated backends, with optional per-backend option
+    dicts. Call before importing the instrument modules.
+
+    """
+    install_u3(**(u3 or {}))
+    install_ljm(**(ljm or {}))
+    install_camera(**(camera or {}))
@@ -0,0 +1,281 @@
+import argparse
+import threading
+import time
+
+import devicebroker
+
+# Pins each instrument uses on its device, so two instruments can't be
+# started on the same pin. The blower's timer and counter sit on FIO4/FIO5
+# (TimerCounterPinOffset=4) and its LJTick-DAC on FIO6/FIO7.
+BLOWER_PINS = {"AIN1", "FIO4", "FIO5", "FIO6", "FIO7"}
+
+
+def dio_name(dio_pin):
+    """U3 DIO number to its FIO/EIO/CIO name."""
+    if dio_pin < 8:
+        return f"FIO{dio_pin}"
+    if dio_pin < 16:
+        return f"EIO{dio_pin - 8}"
+    return f"CIO{dio_pin - 16}"
+
+
+def u3_pins(args):
+    pins = {}
+    if "blower" in args.instruments:
+        pins["blower"] = BLOWER_PINS
+    if "ion" in args.instruments:
+        pins["ion"] = {
+            "AIN0",
+            dio_name(args.ion_dio_pin),
+            dio_name(args.ion_dio_pin + 1),
+        }
+    return pins
+
+
+def t7_pins(args):
+    pins = {}
+    if "mfc" in args.instruments:
+        import mfc_control
+
+        config = mfc_control.load_config(args.mfc_config)
+        mfcs = [config[f"mfc{i+1}"] for i in range(config["num_mfc"])]
+        pins["mfc"] = {mfc["flow_read"] for mfc in mfcs} | {
+            mfc["flow_set"] for mfc in mfcs
+        }
+    if "pump" in args.instruments:
+        import pumprestore
+
+        pins["pump"] = {pumprestore.relay_input}
+    return pins
+
+
+def check_pins(device, pins):
+    """Raises ValueError if two instruments use the same pin."""
+    owners = {}
+    for instrument, instrument_pins in pins.items():
+        for pin in instrument_pins:
+            if pin in owners:
+                raise ValueError(
+                    f"{instrument} and {owners[pin]} both use {pin} on the "
+                    f"{device}"
+                )
+            owners[pin] = instrument
+
+
+def check_acquisition(args):
+    """Raises ValueError if the blower is set to stream, since a U3 stream
+    reads the device outside the broker and blocks the other instruments'
+    analog reads.
+
+    """
+    if "blower" in args.instruments:
+        import blower_box_final
+
+        if blower_box_final.ACQUISITION == "stream":
+            raise ValueError(
+                "The blower can't stream from a U3 shared through the "
+                "broker, set ACQUISITION = 'poll' in blower_box_final.py"
+            )
+
+
+def run_in_thread(name, target, **kwargs):
+    thread = threading.Thread(
+        target=target, kwargs=kwargs, name=name, daemon=True
+    )
+    thread.start()
+    return thread
+
+
+# Each start_* function starts one instrument on its own thread, with its
+# own timing, and returns a function that stops it.
+
+
+def start_blower(args, u3_broker):
+    import blower_box_final
+
+    thread = run_in_thread(
+        "blower", blower_box_final.main, device=u3_broker.proxy()
+    )
+
+    def stop():
+        blower_box_final.stop_schedules()
+        thread.join()
+
+    return stop
+
+
+def start_ion(args, u3_broker):
+    import ion_precipitator
+
+    ion = ion_precipitator.IonPrecipitator(
+        u3_broker.proxy(),
+        args.ion_set_voltage,
+        args.ion_toggle_time,
+        args.ion_dio_pin,
+    )
+    ion.start()
+    return ion.close
+
+
+def start_mfc(args, t7_broker):
+    import mfc_control
+
+    controller = mfc_control.MFCController(
+        mfc_control.load_config(args.mfc_config),
+        t7_broker.handle,
+        t7_broker.proxy(),
+    )
+    controller.start()
+    return controller.stop
+
+
+def start_pump(args, t7_broker):
+    import pumprestore
+
+    stop_event = threading.Event()
+    thread = run_in_thread(
+        "pump",
+        pumprestore.pulse_relay,
+        handle=t7_broker.handle,
+        ljm_api=t7_broker.proxy(),
+        stop=stop_event.is_set,
+    )
+
+    def stop():
+        stop_event.set()
+        thread.join()
+
+    return stop
+
+
+def start_wind(args, broker):
+    import capturewind_graph
+
+    logger = capturewind_graph.WindDataLogger(
+        port=args.wind_port, log_backend=args.wind_log_backend
+    )
+    thread = run_in_thread("wind", logger.run)
+
+    def stop():
+        logger.stop()
+        thread.join()
+
+    return stop
+
+
+def start_camera(args, broker):
+    import captureimg
+
+    stop_event = threading.Event()
+    thread = run_in_thread(
+        "camera",
+        captureimg.main,
+        headless=True,
+        interval=args.camera_interval,
+        stop_event=stop_event,
+    )
+
+    def stop():
+        stop_event.set()
+        thread.join()
+
+    return stop
+
+
+# Instrument name to its start function and the device it runs on
+INSTRUMENTS = {
+    "blower": (start_blower, "U3"),
+    "ion": (start_ion, "U3"),
+    "mfc": (start_mfc, "T7"),
+    "pump": (start_pump, "T7"),
+    "wind": (start_wind, None),
+    "camera": (start_camera, None),
+}
+
+
+def open_brokers(args):
+    """Opens each LabJack used by the selected instruments once and starts
+    its broker.
+
+    """
+    devices = {INSTRUMENTS[name][1] for name in args.instruments}
+    brokers = {}
+    if "U3" in devices:
+        check_pins("U3", u3_pins(args))
+        check_acquisition(args)
+        import u3
+
+        if args.u3_serial is None:
+            device = u3.U3()
+        else:
+            device = u3.U3(firstFound=False, serial=args.u3_serial)
+        device.getCalibrationData()
+        brokers["U3"] = devicebroker.U3Broker(device).start()
+    if "T7" in devices:
+        check_pins("T7", t7_pins(args))
+        from labjack import ljm
+
+        handle = ljm.openS("T7", "ANY", args.t7_identifier)
+        brokers["T7"] = devicebroker.T7Broker(handle).start()
+    return brokers
+
+
+def close_brokers(brokers):
+    if "U3" in brokers:
+        brokers["U3"].stop()
+        brokers["U3"].device.close()
+    if "T7" in brokers:
+        from labjack import ljm
+
+        brokers["T7"].stop()
+        ljm.close(brokers["T7"].handle)
+
+
+def run(args):
+    brokers = open_brokers(args)
+    stops = []
+    try:
+        for name in args.instruments:
+            start, device = INSTRUMENTS[name]
+            stops.append(start(args, brokers.get(device)))
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for stop in reversed(stops):
+            stop()
+        for broker in brokers.values():
+            print(broker.report())
+        close_brokers(brokers)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Run several instruments in one process, sharing each "
+        "LabJack through a device broker"
+    )
+    parser.add_argument(
+        "instruments", nargs="+", choices=sorted(INSTRUMENTS), metavar="name"
+    )
+    parser.add_argument("--u3-serial", type=int, default=None)
+    parser.add_argument("--t7-identifier", default="ANY")
+    parser.add_argument(
+        "--ion-dio-pin",
+        type=int,
+        default=4,
+        help="Ion LJTick-DAC DIO (use 8 for EIO0 when running the blower)",
+    )
+    parser.add_argument("--ion-set-voltage", type=float, default=1000.0)
+    parser.add_argument("--ion-toggle-time", type=float, default=30.0)
+    parser.add_argument("--mfc-config", default="mfc_config.yml")
+    parser.add_argument("--wind-port", default="COM3")
+    parser.add_argument(
+        "--wind-log-backend", choices=["csv", "columnar"], default="csv"
+    )
+    parser.add_argument("--camera-interval", type=float, default=5)
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,57 @@
+from collections import deque
+
+
+class TelemetryBus:
+    """Hands messages between acquisition threads and a Tk GUI.
+
+    Publishers append (topic, value) pairs to a deque, which is atomic in
+    CPython, so they never wait on a lock or on the GUI. The consumer
+    drains everything queued so far and keeps only the newest value of
+    each topic. The same class carries control inputs the other way, with
+    the GUI publishing and the acquisition thread draining.
+
+    """
+
+    def __init__(self, maxlen=10000):
+        """maxlen: Messages kept if the consumer falls behind (oldest are
+        dropped first).
+
+        """
+        self._queue = deque(maxlen=maxlen)
+        self._subscribers = {}
+
+    def publish(self, topic, value):
+        self._queue.append((topic, value))
+
+    def drain(self):
+        """Returns a dict of the newest value of each topic published
+        since the last drain.
+
+        """
+        latest = {}
+        while True:
+            try:
+                topic, value = self._queue.popleft()
+            except IndexError:
+                return latest
+            latest[topic] = value
+
+    def subscribe(self, topic, callback):
+        """Registers callback(value), called from dispatch()."""
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    def dispatch(self):
+        """Drains the bus and calls the subscribers of each topic once."""
+        for topic, value in self.drain().items():
+            for callback in self._subscribers.get(topic, []):
+                callback(value)
+
+    def attach(self, root, interval_ms=200):
+        """Dispatches on the Tk event loop every `interval_ms`."""
+
+        def tick():
+            # Reschedule first, so a failing subscriber can't stop updates
+            root.after(interval_ms, tick)
+            self.dispatch()
+
+        root.after(interval_ms, tick)
@@ -0,0 +1,79 @@
+import time
+
+import u3
+
+
+class Snapshot:
+    """Values read together in one getFeedback packet."""
+
+    def __init__(self, timestamp, values):
+        self.timestamp = timestamp
+        self.values = values
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+    def __repr__(self):
+        return f"Snapshot({self.timestamp}, {self.values})"
+
+
+class FeedbackBatcher:
+    """Packs U3 AIN, timer and counter reads into one getFeedback call.
+
+    Commands are added once at startup, then read() sends them all in a
+    single USB transaction and returns a timestamped Snapshot with the
+    converted results by name.
+
+    """
+
+    def __init__(self, device):
+        """device: The object to an opened U3."""
+        self.device = device
+        self.names = []
+        self.commands = []
+        self.converters = []
+
+    def add(self, name, command, convert=None):
+        """Adds a feedback command (e.g. u3.Timer(0), u3.Counter(1)).
+
+        convert: Optional callable applied to the raw result.
+
+        """
+        self.names.append(name)
+        self.commands.append(command)
+        self.converters.append(convert)
+
+    def add_ain(self, name, channel, negative_channel=31):
+        """Adds an analog input read, converted to calibrated volts."""
+        is_low_voltage = not (
+            getattr(self.device, "isHV", False) and channel < 4
+        )
+        is_single_ended = negative_channel == 31
+
+        def convert(bits):
+            return self.device.binaryToCalibratedAnalogVoltage(
+                bits,
+                isLowVoltage=is_low_voltage,
+                isSingleEnded=is_single_ended,
+                isSpecialSetting=False,
+                channelNumber=channel,
+            )
+
+        self.add(
+            name,
+            u3.AIN(PositiveChannel=channel, NegativeChannel=negative_channel),
+            convert,
+        )
+
+    def read(self):
+        """Sends all commands in one packet and returns a Snapshot."""
+        start = time.time()
+        results = self.device.getFeedback(*self.commands)
+        timestamp = (start + time.time()) / 2
+        values = {}
+        for name, result, convert in zip(self.names, results, self.converters):
+            values[name] = convert(result) if convert else result
+        return Snapshot(timestamp, values)
@@ -0,0 +1,89 @@
+import threading
+import time
+
+
+class U3StreamReader:
+    """Streams analog inputs from a U3 and drains them on a thread.
+
+    The U3 samples the channels in hardware at `scan_rate` scans per
+    second. Each block read from the stream is handed to the `on_block`
+    callbacks and the newest value of each channel is kept for callers
+    that only need the current reading.
+
+    Analog inputs cannot be read with getAIN/getFeedback while the U3 is
+    streaming, but timer, counter and I2C commands still work.
+
+    """
+
+    def __init__(
+        self, device, channels=(1,), scan_rate=1000, samples_per_packet=25
+    ):
+        """device: The object to an opened U3.
+        channels: Positive AIN channels to stream (single-ended).
+        scan_rate: Scans per second.
+        samples_per_packet: Samples per USB packet (1-25).
+
+        """
+        self.device = device
+        self.channels = list(channels)
+        self.scan_rate = scan_rate
+        self.samples_per_packet = samples_per_packet
+
+        self.callbacks = []
+        self.scans = 0
+        self.missed = 0
+        self.errors = 0
+        self.running = False
+        self._latest = {channel: None for channel in self.channels}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def on_block(self, callback):
+        """Registers callback(channel, samples, timestamp) for each block."""
+        self.callbacks.append(callback)
+
+    def start(self):
+        self.device.streamConfig(
+            NumChannels=len(self.channels),
+            PChannels=self.channels,
+            NChannels=[31] * len(self.channels),
+            Resolution=3,
+            ScanFrequency=self.scan_rate,
+            SamplesPerPacket=self.samples_per_packet,
+        )
+        self.device.streamStart()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.device.streamStop()
+
+    def latest(self, channel):
+        """Returns the newest sample of a channel, None before the first."""
+        with self._lock:
+            return self._latest[channel]
+
+    def _run(self):
+        for result in self.device.streamData():
+            if not self.running:
+                break
+            if result is None:
+                continue
+            timestamp = time.time()
+            with self._lock:
+                self.errors += result["errors"]
+                self.missed += result["missed"]
+                for channel in self.channels:
+                    samples = result[f"AIN{channel}"]
+                    if samples:
+                        self._latest[channel] = samples[-1]
+                self.scans += len(result[f"AIN{self.channels[0]}"])
+            for channel in self.channels:
+                samples = result[f"AIN{channel}"]
+                for callback in self.callbacks:
+                    callback(channel, samples, timestamp)
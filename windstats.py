@@ -0,0 +1,141 @@
+import math
+from collections import deque
+
+
+class WindWindow:
+    """Running wind vector sums over the last `samples` samples or the
+    last `span` seconds.
+
+    Each sample adds its u/v components (speed-weighted, direction in
+    degrees clockwise from north) and its scalar speed to running totals,
+    so reading the statistics is O(1). A time window doesn't keep its
+    samples: they are summed into `buckets` buckets of span/buckets
+    seconds, and whole buckets are subtracted as they expire, so the
+    window edge has a resolution of one bucket.
+
+    """
+
+    def __init__(self, span=None, samples=None, buckets=60):
+        """span: Window length in seconds.
+        samples: Window length in samples, used instead of span.
+        buckets: Buckets a time window is divided into.
+
+        """
+        if (span is None) == (samples is None):
+            raise ValueError("Give exactly one of span or samples")
+        self.span = span
+        self.samples = samples
+        self.bucket_width = span / buckets if span else None
+        # [key, count, u, v, speed] per bucket, or per sample
+        self._entries = deque()
+        self.count = 0
+        self.u = 0.0
+        self.v = 0.0
+        self.speed = 0.0
+
+    def add(self, timestamp, speed, direction):
+        radians = math.radians(direction)
+        u = speed * math.sin(radians)
+        v = speed * math.cos(radians)
+        if self.samples is not None:
+            self._entries.append([None, 1, u, v, speed])
+            if len(self._entries) > self.samples:
+                self._remove(self._entries.popleft())
+        else:
+            key = math.floor(timestamp / self.bucket_width)
+            if self._entries and self._entries[-1][0] == key:
+                entry = self._entries[-1]
+                entry[1] += 1
+                entry[2] += u
+                entry[3] += v
+                entry[4] += speed
+            else:
+                self._entries.append([key, 1, u, v, speed])
+            self.expire(timestamp)
+        self.count += 1
+        self.u += u
+        self.v += v
+        self.speed += speed
+
+    def expire(self, now):
+        """Drops the buckets that ended more than span seconds ago."""
+        if self.span is None:
+            return
+        oldest = math.floor((now - self.span) / self.bucket_width)
+        while self._entries and self._entries[0][0] <= oldest:
+            self._remove(self._entries.popleft())
+
+    def _remove(self, entry):
+        self.count -= entry[1]
+        self.u -= entry[2]
+        self.v -= entry[3]
+        self.speed -= entry[4]
+        if not self._entries:
+            # Clear the rounding left over from the subtractions
+            self.count, self.u, self.v, self.speed = 0, 0.0, 0.0, 0.0
+
+    def summary(self):
+        """Returns (count, mean speed, vector mean speed, vector mean
+        direction, steadiness), with NaN statistics for an empty window.
+
+        Steadiness is the vector mean speed over the mean speed: 1 for a
+        constant direction, near 0 for wind from all around.
+
+        """
+        if self.count <= 0:
+            nan = float("nan")
+            return 0, nan, nan, nan, nan
+        mean_speed = self.speed / self.count
+        vector_speed = math.hypot(self.u, self.v) / self.count
+        direction = math.degrees(math.atan2(self.u, self.v)) % 360
+        if direction == 360:  # -1e-15 % 360 rounds up
+            direction = 0.0
+        steadiness = vector_speed / mean_speed if mean_speed > 0 else 0.0
+        return self.count, mean_speed, vector_speed, direction, steadiness
+
+
+class WindStatistics:
+    """Several WindWindows fed the same samples."""
+
+    # Window name to WindWindow arguments
+    DEFAULT_WINDOWS = {
+        "8 samples": {"samples": 8},
+        "1 min": {"span": 60},
+        "10 min": {"span": 600},
+        "1 h": {"span": 3600},
+    }
+    FIELDS = [
+        "Count",
+        "Mean Speed (m/s)",
+        "Vector Speed (m/s)",
+        "Direction",
+        "Steadiness",
+    ]
+
+    def __init__(self, windows=None):
+        windows = self.DEFAULT_WINDOWS if windows is None else windows
+        self.windows = {
+            name: WindWindow(**kwargs) for name, kwargs in windows.items()
+        }
+
+    def add(self, timestamp, speed, direction):
+        for window in self.windows.values():
+            window.add(timestamp, speed, direction)
+
+    def summary(self, name, now=None):
+        window = self.windows[name]
+        if now is not None:
+            window.expire(now)
+        return window.summary()
+
+    def header(self):
+        """Column names of row(), FIELDS for each window."""
+        return [
+            f"{name} {field}" for name in self.windows for field in self.FIELDS
+        ]
+
+    def row(self, now=None):
+        row = []
+        for name in self.windows:
+            row.extend(self.summary(name, now))
+        return row